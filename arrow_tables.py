@@ -0,0 +1,380 @@
+"""
+Time table as Arrow tables (Feather or Parquet files)
+
+Parsed time table is exported as three normalised tables which can be
+joined with other data sets:
+
+    * stops: every row of the time table in file order (number, seq,
+      station_code, station_name, arrival_time, departure_time, distance)
+    * trains: one row per train number (name, source and destination
+      station, number of stops, total distance)
+    * stations: station file (code, name, state, zone)
+
+Station codes, names and other repeated strings are dictionary encoded,
+seq is int32, times are time32[s] and distance is float64 (missing values
+are null). Train columns which are not same in every row of a train number
+are kept in the stops table instead.
+
+Feather files are written uncompressed as one record batch, so load_store()
+memory maps them and integer codes of train numbers and stations of the
+TimetableStore point directly into the file. Parquet files are smaller but
+are decompressed while reading. Both formats support reading only some
+columns, see read_table().
+
+    python arrow_tables.py export tables --format parquet
+
+pyarrow is needed only for this module.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+import helper
+from stations import StationIndex
+from timetable import (COLUMNS, MISSING, TimetableStore, find_trains,
+                       format_seconds)
+
+TABLES = ("trains", "stops", "stations")
+FORMATS = ("feather", "parquet")
+
+# Columns which describe the train and not the stop
+TRAIN_COLUMNS = ("name", "source_station", "source_station_name",
+                 "destination_station", "destination_station_name")
+
+# Key of the schema metadata with header and fingerprint of the time table
+METADATA_KEY = b"railway"
+
+
+def _dictionary(codes: np.ndarray, categories: list, valid=None):
+    import pyarrow as pa
+
+    mask = None if valid is None else ~valid
+    return pa.DictionaryArray.from_arrays(
+        pa.array(codes, type=pa.int32(), mask=mask),
+        pa.array(categories, type=pa.string()))
+
+
+def _nullable(values: np.ndarray, missing, arrow_type=None):
+    import pyarrow as pa
+
+    mask = np.isnan(values) if np.isnan(missing) else values == missing
+    array = pa.array(values, mask=mask if mask.any() else None)
+    return array if arrow_type is None else array.cast(arrow_type)
+
+
+def _numpy(column, dtype, missing=None) -> np.ndarray:
+    """
+    :param column: Fixed width Arrow array or chunked array
+    :param dtype: NumPy type with same width as the Arrow type
+    :param missing: Value used for nulls
+    :return: NumPy array, zero copy when there is one chunk without nulls
+    """
+    import pyarrow as pa
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.chunk(0) if column.num_chunks == 1 else \
+            column.combine_chunks()
+    if len(column) == 0:
+        return np.zeros(0, dtype=dtype)
+    values = np.frombuffer(column.buffers()[1], dtype=dtype)[
+             column.offset:column.offset + len(column)]
+    if column.null_count > 0:
+        values = values.copy()
+        values[~column.is_valid().to_numpy(zero_copy_only=False)] = missing
+    return values
+
+
+def _decode(column) -> tuple:
+    """
+    :param column: Dictionary encoded Arrow array or chunked array
+    :return: (integer codes, unique values), nulls get code 0
+    """
+    import pyarrow as pa
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.chunk(0) if column.num_chunks == 1 else \
+            column.combine_chunks()
+    if not pa.types.is_dictionary(column.type):
+        column = column.dictionary_encode()
+    return (_numpy(column.indices, np.int32, 0).astype(np.int32, copy=False),
+            column.dictionary.to_pylist())
+
+
+def _encode(values: np.ndarray, formatter) -> tuple:
+    """
+    :param values: Numeric values of every row
+    :param formatter: Function which gives string of one value
+    :return: (codes, categories) with every distinct value formatted once
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    return (inverse.reshape(-1).astype(np.int32),
+            [formatter(x) for x in unique.tolist()])
+
+
+def _format_distance(value: float) -> str:
+    if np.isnan(value):
+        return "NA"
+    return "%d" % value if value.is_integer() else repr(value)
+
+
+def stops_table(store: TimetableStore, train_columns=()):
+    """
+    :param store: TimetableStore
+    :param train_columns: Columns of TRAIN_COLUMNS which should be kept in
+    this table as well
+    :return: pyarrow Table with one row per time table row
+    """
+    import pyarrow as pa
+
+    columns = {
+        "number": _dictionary(store.codes("number"), store.train_numbers),
+        "seq": _nullable(store.seq, MISSING),
+        "station_code": _dictionary(store.station_ids, store.station_codes),
+        "station_name": _dictionary(store.codes("station_name"),
+                                    store.categories("station_name")),
+        "arrival_time": _nullable(store.arrival, MISSING, pa.time32("s")),
+        "departure_time": _nullable(store.departure, MISSING,
+                                    pa.time32("s")),
+        "distance": _nullable(store.distance, np.nan)}
+    for c in train_columns:
+        columns[c] = _dictionary(store.codes(c), store.categories(c))
+    meta = {"header": store.header, "source": store.source}
+    return pa.table(columns, metadata={METADATA_KEY: json.dumps(meta)})
+
+
+def trains_table(store: TimetableStore) -> tuple:
+    """
+    :param store: TimetableStore
+    :return: (pyarrow Table with one row per train number, columns of
+    TRAIN_COLUMNS which differ between rows of same train number)
+    """
+    import pyarrow as pa
+
+    numbers = store.codes("number")
+    size = len(store.train_numbers)
+    used, first = np.unique(numbers, return_index=True)
+    valid = np.zeros(size, dtype=bool)
+    valid[used] = True
+
+    columns = {"number": pa.array(store.train_numbers, type=pa.string())}
+    varying = []
+    for c in TRAIN_COLUMNS:
+        codes = np.zeros(size, dtype=np.int32)
+        codes[used] = store.codes(c)[first]
+        if not np.array_equal(codes[numbers], store.codes(c)):
+            varying.append(c)
+            continue
+        columns[c] = _dictionary(codes, store.categories(c), valid)
+
+    stops = numbers[store.stop_rows]
+    columns["stops"] = pa.array(np.bincount(stops, minlength=size).astype(
+        np.int32))
+    distance = np.full(size, np.nan)
+    np.fmax.at(distance, stops, store.distance[store.stop_rows])
+    columns["distance"] = _nullable(distance, np.nan)
+    return pa.table(columns), varying
+
+
+def stations_table(index: StationIndex = None):
+    """
+    :param index: StationIndex (default: helper.get_station_index())
+    :return: pyarrow Table with one row per station
+    """
+    import pyarrow as pa
+
+    if index is None:
+        index = helper.get_station_index()
+    return pa.table({
+        "station_code": pa.array(index.codes, type=pa.string()),
+        "name": pa.array(index.names, type=pa.string()),
+        "state": _dictionary(index.state_ids, index.states,
+                             index.state_ids >= 0),
+        "zone": _dictionary(index.zone_ids, index.zones,
+                            index.zone_ids >= 0)})
+
+
+def table_path(directory: str, name: str,
+               file_format: str = "feather") -> str:
+    """
+    :param directory: Folder of exported tables
+    :param name: One of the TABLES
+    :param file_format: 'feather' or 'parquet'
+    :return: Path of the table file
+    """
+    return os.path.join(directory, "%s.%s" % (name, file_format))
+
+
+def write_table(table, path: str) -> None:
+    """
+    Writes table in temporary file and renames it, so readers never see half
+    written file
+    :param table: pyarrow Table
+    :param path: File ending with .feather or .parquet
+    """
+    temp = "%s.tmp-%d" % (path, os.getpid())
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        pq.write_table(table, temp)
+    else:
+        from pyarrow import feather
+        # One uncompressed record batch can be memory mapped without copy
+        feather.write_feather(table, temp, compression="uncompressed",
+                              chunksize=max(table.num_rows, 1))
+    os.replace(temp, path)
+
+
+def export_tables(directory: str, store: TimetableStore = None,
+                  file_format: str = "feather",
+                  stations: bool = True) -> dict:
+    """
+    :param directory: Output folder, created if needed
+    :param store: TimetableStore (default: helper.get_store())
+    :param file_format: 'feather' or 'parquet'
+    :param stations: If True, station file is exported as well
+    :return: Dictionary with table name as key and path as value
+    """
+    if file_format not in FORMATS:
+        raise ValueError("Unknown format '%s'" % file_format)
+    if store is None:
+        store = helper.get_store()
+    os.makedirs(directory, exist_ok=True)
+
+    trains, varying = trains_table(store)
+    tables = {"trains": trains, "stops": stops_table(store, varying)}
+    if stations:
+        tables["stations"] = stations_table()
+    paths = {}
+    for name, table in tables.items():
+        paths[name] = table_path(directory, name, file_format)
+        write_table(table, paths[name])
+    return paths
+
+
+def _find(directory: str, name: str, file_format: str = None) -> str:
+    for f in (file_format,) if file_format is not None else FORMATS:
+        path = table_path(directory, name, f)
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError("No %s table in %s" % (name, directory))
+
+
+def read_table(directory: str, name: str, columns: list = None,
+               file_format: str = None, mmap: bool = True):
+    """
+    :param directory: Folder of exported tables
+    :param name: One of the TABLES
+    :param columns: Names of columns to read (default: all)
+    :param file_format: 'feather' or 'parquet' (default: whichever exists)
+    :param mmap: If True, file is memory mapped instead of read
+    :return: pyarrow Table
+    """
+    path = _find(directory, name, file_format)
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=mmap)
+    from pyarrow import feather
+    return feather.read_table(path, columns=columns, memory_map=mmap)
+
+
+def load_store(directory: str, file_format: str = None,
+               mmap: bool = True) -> TimetableStore:
+    """
+    Rebuilds TimetableStore from exported trains and stops tables. Numbers,
+    station codes and other strings are same as in the CSV file, times and
+    distances are formatted again from their values (e.g. 'HH:MM:SS',
+    'NA' for missing distance). Use helper.set_store() to make it the
+    shared store.
+    :param directory: Folder of exported tables
+    :param file_format: See read_table()
+    :param mmap: See read_table()
+    :return: TimetableStore
+    """
+    import pyarrow as pa
+
+    stops = read_table(directory, "stops", file_format=file_format,
+                       mmap=mmap)
+    trains = read_table(directory, "trains", file_format=file_format,
+                        mmap=mmap)
+    meta = json.loads((stops.schema.metadata or {}).get(METADATA_KEY,
+                                                        b"{}"))
+
+    codes, categories = {}, {}
+    for c in ("number", "station_code", "station_name"):
+        codes[c], categories[c] = _decode(stops.column(c))
+
+    # Parquet may reorder dictionaries, so rows of trains table are matched
+    # by train number
+    position = {x: i for i, x in enumerate(
+        trains.column("number").to_pylist())}
+    remap = np.asarray([position[x] for x in categories["number"]] + [0],
+                       dtype=np.int64)
+    train_rows = remap[codes["number"]]
+    for c in TRAIN_COLUMNS:
+        if c in stops.column_names:
+            codes[c], categories[c] = _decode(stops.column(c))
+        else:
+            train_codes, categories[c] = _decode(trains.column(c))
+            codes[c] = train_codes[train_rows]
+
+    derived = {"seq": _numpy(stops.column("seq"), np.int32, MISSING),
+               "distance": _numpy(stops.column("distance"), np.float64,
+                                  np.nan)}
+    for c, d in (("arrival_time", "arrival"),
+                 ("departure_time", "departure")):
+        # Parquet keeps times in milliseconds
+        derived[d] = _numpy(stops.column(c).cast(pa.time32("s")), np.int32,
+                            MISSING)
+        codes[c], categories[c] = _encode(
+            derived[d], lambda x: "" if x == MISSING else format_seconds(x))
+    codes["seq"], categories["seq"] = _encode(
+        derived["seq"], lambda x: "" if x == MISSING else str(x))
+    codes["distance"], categories["distance"] = _encode(derived["distance"],
+                                                        _format_distance)
+    derived["stop_rows"], derived["train_offsets"] = find_trains(
+        derived["distance"], codes["number"])
+
+    store = TimetableStore({c: codes[c] for c in COLUMNS}, categories,
+                           meta.get("header"), derived)
+    store.source = meta.get("source")
+    return store
+
+
+def load_station_index(directory: str,
+                       file_format: str = None) -> StationIndex:
+    """
+    :param directory: Folder of exported tables
+    :param file_format: See read_table()
+    :return: StationIndex of exported stations table
+    """
+    table = read_table(directory, "stations", file_format=file_format)
+    columns = [table.column(c).to_pylist()
+               for c in ("station_code", "name", "state", "zone")]
+    return StationIndex([[code, name, state or "", zone or ""]
+                         for code, name, state, zone in zip(*columns)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export time table as Arrow tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write trains, stops and "
+                                                "stations tables")
+    export.add_argument("directory", help="Output folder")
+    export.add_argument("--format", choices=FORMATS, default="feather")
+    export.add_argument("--data", default=None, help="Time table CSV file")
+    export.add_argument("--stations", default=helper.STATION_DATA_FILE,
+                        help="Station file, skipped if it does not exist")
+    args = parser.parse_args(argv)
+
+    helper.STATION_DATA_FILE = args.stations
+    paths = export_tables(args.directory, helper.get_store(args.data),
+                          args.format, os.path.isfile(args.stations))
+    for name, path in paths.items():
+        print("%s: %s (%d bytes)" % (name, path, os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    main()
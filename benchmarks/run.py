@@ -0,0 +1,262 @@
+"""
+Benchmarks of loaders, connectivity and map aggregations
+
+Runs every benchmark on a synthetic time table (see benchmarks.synthetic),
+records best wall time of several runs and peak traced memory (tracemalloc,
+separate run) and writes them to JSON. When a baseline file is given, times
+and memory are compared with it and exit status is 1 if anything got slower
+or bigger than the tolerance allows. Run from repository root:
+
+    python -m benchmarks.run --rows 100000 --save-baseline
+    python -m benchmarks.run --rows 100000 --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+# Results of earlier runs should not hide the work
+os.environ.setdefault("RAILWAY_NO_RESULT_CACHE", "1")
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+import helper
+from benchmarks.synthetic import generate_timetable
+
+DATA_DIR = os.path.join("benchmarks", "data")
+BASELINE_FILE = os.path.join("benchmarks", "baseline.json")
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+
+# Name : (function, setup), setup returns arguments of the function
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name: str, setup=None):
+    """
+    Registers a benchmark
+    :param name: Name used in results
+    :param setup: Function returning tuple of arguments, not measured
+    """
+
+    def register(func):
+        BENCHMARKS[name] = (func, setup)
+        return func
+
+    return register
+
+
+def _store():
+    return helper.get_store(use_cache=False)
+
+
+def _trains():
+    return (helper.get_full_trains(),)
+
+
+@benchmark("parse_csv")
+def parse_csv():
+    from timetable import TimetableStore
+    return TimetableStore.from_csv(helper.TRAIN_DATA_FILE)
+
+
+@benchmark("get_data", setup=lambda: (_store(), ))
+def get_data(_):
+    return len(helper.get_data())
+
+
+@benchmark("get_full_trains", setup=lambda: (_store(), ))
+def get_full_trains(_):
+    return len(helper.get_full_trains())
+
+
+@benchmark("get_connection_pairs", setup=_trains)
+def get_connection_pairs(trains):
+    return sum(len(t.get_connection_pairs()) for t in trains)
+
+
+@benchmark("zone_connectivity", setup=lambda: (_store(), ))
+def zone_connectivity(store):
+    from connectivity import connectivity_matrix
+    return connectivity_matrix("zone", store=store)[0].sum()
+
+
+@benchmark("state_connectivity", setup=lambda: (_store(), ))
+def state_connectivity(store):
+    from connectivity import connectivity_matrix
+    return connectivity_matrix("state", reject=["None", "BANG"],
+                               store=store)[0].sum()
+
+
+@benchmark("zone_counts", setup=_trains)
+def zone_counts(trains):
+    from blog2.new_vs_old import _zone_counts
+    return sum(_zone_counts(trains).values())
+
+
+@benchmark("map_stops_per_state", setup=lambda: (_store(), ))
+def map_stops_per_state(store):
+    index = helper.get_station_index()
+    states = index.state_ids_of(index.ids(store.station_codes))
+    return sum(helper.state_counter(states[store.station_ids]).values())
+
+
+@benchmark("map_origin_states", setup=_trains)
+def map_origin_states(trains):
+    from blog3.visualize_maps import _origin_state_counts
+    return sum(_origin_state_counts(trains).values())
+
+
+@benchmark("map_departure_times", setup=lambda: (_store(), ))
+def map_departure_times(store):
+    first = store.first_stops()
+    return store.time_histogram(
+        "departure", filter=first[helper.long_distance_rows(store, first)])
+
+
+def timetable_file(rows: int, seed: int, data_dir: str = DATA_DIR) -> str:
+    """
+    :return: Synthetic time table with given size, generated only once
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, "synthetic_%d_%d.csv" % (rows, seed))
+    if not os.path.isfile(path):
+        generate_timetable(path + ".tmp", rows, seed)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def measure(name: str, repeat: int = 3) -> dict:
+    """
+    :param name: One of BENCHMARKS
+    :param repeat: Number of timed runs
+    :return: {"time": best seconds, "times": all runs, "peak_memory": bytes}
+    """
+    func, setup = BENCHMARKS[name]
+    args = setup() if setup is not None else ()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows down allocations, so memory is measured separately
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"time": min(times), "times": times, "peak_memory": peak}
+
+
+def run(names: list, rows: int, seed: int = 0, repeat: int = 3,
+        path: str = None) -> dict:
+    """
+    :param names: Benchmarks to run
+    :param rows: Rows of synthetic time table
+    :param seed: Seed of synthetic time table
+    :param repeat: Number of timed runs
+    :param path: Own time table instead of synthetic one
+    :return: Results with environment details
+    """
+    helper.TRAIN_DATA_FILE = path or timetable_file(rows, seed)
+    results = OrderedDict()
+    for name in names:
+        results[name] = measure(name, repeat)
+        print("%-24s %10.4f s %10.1f MB" % (
+            name, results[name]["time"],
+            results[name]["peak_memory"] / 2 ** 20))
+    return {"meta": {"rows": rows, "seed": seed, "data": path,
+                     "python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "machine": platform.platform(),
+                     "date": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+
+def compare(current: dict, baseline: dict,
+            time_tolerance: float = TIME_TOLERANCE,
+            memory_tolerance: float = MEMORY_TOLERANCE) -> list:
+    """
+    :param current: Result of run()
+    :param baseline: Result of earlier run()
+    :param time_tolerance: Allowed relative increase of time
+    :param memory_tolerance: Allowed relative increase of peak memory
+    :return: Descriptions of regressions
+    """
+    regressions = []
+    for name, now in current["results"].items():
+        then = baseline["results"].get(name)
+        if then is None:
+            continue
+        for key, tolerance in (("time", time_tolerance),
+                               ("peak_memory", memory_tolerance)):
+            ratio = now[key] / then[key] if then[key] > 0 else 1
+            print("%-24s %-12s %6.2fx" % (name, key, ratio))
+            if ratio > 1 + tolerance:
+                regressions.append("%s: %s %.2fx of baseline" % (
+                    name, key, ratio))
+    if current["meta"]["rows"] != baseline["meta"]["rows"]:
+        print("Warning: baseline has %s rows" % baseline["meta"]["rows"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run benchmarks")
+    parser.add_argument("names", nargs="*",
+                        help="Benchmarks to run (default: all)")
+    parser.add_argument("--list", action="store_true",
+                        help="List available benchmarks")
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="Rows of synthetic time table")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", default=None,
+                        help="Own time table instead of synthetic one")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None,
+                        help="Write results to this JSON file")
+    parser.add_argument("--baseline", default=None,
+                        help="Compare with this JSON file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Write results to " + BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE,
+                        help="Allowed relative increase of time")
+    parser.add_argument("--memory-tolerance", type=float,
+                        default=MEMORY_TOLERANCE,
+                        help="Allowed relative increase of peak memory")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in BENCHMARKS:
+            print(name)
+        return 0
+    unknown = [x for x in args.names if x not in BENCHMARKS]
+    if len(unknown) > 0:
+        parser.error("Unknown benchmarks: " + ", ".join(unknown))
+
+    results = run(args.names or list(BENCHMARKS), args.rows, args.seed,
+                  args.repeat, args.data)
+    for path in (args.output, BASELINE_FILE if args.save_baseline else None):
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance,
+                                  args.memory_tolerance)
+        for x in regressions:
+            print("Regression: " + x)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
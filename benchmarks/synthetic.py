@@ -0,0 +1,183 @@
+"""
+Seeded generator of synthetic time tables
+
+Files have the same 12 columns as the real time table (see main.py) so that
+performance can be measured without the real data. Stations are taken from
+the station file when it exists (so that state and zone lookups work) and
+some stations are much busier than others. Stops per train, running times
+and distances roughly follow the real time table: first stop has arrival
+and last stop has departure '00:00:00', trains run over midnight and a small
+fraction of rows have 'NA' distance.
+
+    python -m benchmarks.synthetic timetable.csv --rows 1000000 --seed 1
+"""
+
+import argparse
+import csv
+import os
+
+import numpy as np
+
+HEADER = ["Train No", "Train Name", "SEQ", "Station Code", "Station Name",
+          "Arrival time", "Departure Time", "Distance", "Source Station",
+          "Source Station Name", "Destination Station",
+          "Destination Station Name"]
+
+MEAN_STOPS = 14
+MAX_STOPS = 130
+NA_FRACTION = 0.002
+CHUNK_ROWS = 1 << 18
+
+
+def load_stations(path: str = "stations_data.txt",
+                  size: int = 8000) -> tuple:
+    """
+    :param path: Station file, synthetic codes are used if it is missing
+    :param size: Number of synthetic stations
+    :return: (codes, names)
+    """
+    codes, names = [], []
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                fields = line.strip().split(";")
+                if len(fields[0]) > 0:
+                    codes.append(fields[0])
+                    names.append(fields[1].upper() if len(fields) > 1
+                                 else fields[0])
+    if len(codes) == 0:
+        codes = ["S%04d" % i for i in range(size)]
+        names = ["STATION %d" % i for i in range(size)]
+    return codes, names
+
+
+def train_numbers(count: int, rng) -> list:
+    """
+    :param count: Number of trains
+    :param rng: numpy Generator
+    :return: Unique train numbers, 5 digit numbers are used first
+    """
+    five = ["%05d" % x for x in rng.permutation(100000)[:count]]
+    return five + [str(100000 + x) for x in range(count - len(five))]
+
+
+def _clock(seconds: np.ndarray) -> list:
+    seconds = seconds % 86400
+    return ["%02d:%02d:%02d" % (x // 3600, x // 60 % 60, x % 60)
+            for x in seconds.tolist()]
+
+
+def generate_timetable(path: str, rows: int, seed: int = 0,
+                       station_file: str = "stations_data.txt",
+                       na_fraction: float = NA_FRACTION) -> str:
+    """
+    :param path: Output CSV file
+    :param rows: Number of rows (without header)
+    :param seed: Same seed gives same file
+    :param station_file: See load_stations()
+    :param na_fraction: Fraction of rows with 'NA' distance
+    :return: path
+    """
+    rng = np.random.default_rng(seed)
+    codes, names = load_stations(station_file)
+    # Busy junctions and quiet halts
+    weights = 1 / np.arange(1, len(codes) + 1) ** 0.8
+    weights = weights[rng.permutation(len(codes))]
+    weights /= weights.sum()
+
+    stops = np.clip(rng.lognormal(np.log(MEAN_STOPS), 0.7,
+                                  rows // 2 + 1).astype(np.int64), 2,
+                    MAX_STOPS)
+    n_trains = int(np.searchsorted(np.cumsum(stops), rows)) + 1
+    stops = stops[:n_trains]
+    stops[-1] -= stops.sum() - rows
+    stops = stops[stops > 0]
+    numbers = train_numbers(len(stops), rng)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        first = 0
+        while first < len(stops):
+            last = int(np.searchsorted(np.cumsum(stops[first:]),
+                                       CHUNK_ROWS)) + first + 1
+            _write_chunk(writer, stops[first:last], numbers[first:last],
+                         codes, names, weights, na_fraction, rng)
+            first = last
+    return path
+
+
+def _write_chunk(writer, stops, numbers, codes, names, weights,
+                 na_fraction, rng) -> None:
+    size = int(stops.sum())
+    train = np.repeat(np.arange(len(stops)), stops)
+    starts = np.cumsum(stops) - stops
+    seq = np.arange(size) - starts[train] + 1
+    is_first = seq == 1
+    is_last = seq == stops[train]
+
+    station = rng.choice(len(codes), size=size, p=weights)
+    # Same station twice in a row is very rare in the real data
+    repeated = np.flatnonzero(~is_first[1:] & (station[1:] == station[:-1]))
+    station[repeated + 1] = (station[repeated + 1] + 1) % len(codes)
+
+    # Times are whole minutes like in the real time table
+    run = np.maximum(rng.lognormal(np.log(25), 0.6, size).astype(np.int64),
+                     1) * 60
+    halt = rng.integers(1, 10, size) * 60
+    run[is_first] = rng.integers(0, 1440, len(stops)) * 60
+    halt[is_first] = 0
+    # Time of arrival at every stop, first stop starts from its own clock
+    elapsed = np.cumsum(run + halt) - halt
+    base = elapsed[starts] - run[starts]
+    arrival = elapsed - base[train]
+    departure = arrival + halt
+    departure[is_first] = arrival[is_first]
+
+    hop = rng.integers(3, 60, size)
+    hop[is_first] = 0
+    distance = np.cumsum(hop)
+    distance -= distance[starts][train]
+
+    arrival_text = _clock(arrival)
+    departure_text = _clock(departure)
+    distance_text = [str(x) for x in distance.tolist()]
+    for i in np.flatnonzero(is_first):
+        arrival_text[i] = "00:00:00"
+    for i in np.flatnonzero(is_last):
+        departure_text[i] = "00:00:00"
+    for i in np.flatnonzero(rng.random(size) < na_fraction):
+        distance_text[i] = "NA"
+
+    source = station[starts]
+    destination = station[starts + stops - 1]
+    train_names = ["%s-%s EXP" % (names[s], names[d])
+                   for s, d in zip(source.tolist(), destination.tolist())]
+    station, train, seq = station.tolist(), train.tolist(), seq.tolist()
+    source, destination = source.tolist(), destination.tolist()
+    writer.writerows(
+        (numbers[t], train_names[t], seq[i], codes[station[i]],
+         names[station[i]], arrival_text[i], departure_text[i],
+         distance_text[i], codes[source[t]], names[source[t]],
+         codes[destination[t]], names[destination[t]])
+        for i, t in enumerate(train))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic time table")
+    parser.add_argument("path", help="Output CSV file")
+    parser.add_argument("--rows", type=int, default=100000,
+                        help="Number of rows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stations", default="stations_data.txt",
+                        help="Station file used for station codes")
+    parser.add_argument("--na-fraction", type=float, default=NA_FRACTION,
+                        help="Fraction of rows with 'NA' distance")
+    args = parser.parse_args(argv)
+    generate_timetable(args.path, args.rows, args.seed, args.stations,
+                       args.na_fraction)
+
+
+if __name__ == "__main__":
+    main()
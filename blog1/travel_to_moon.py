@@ -6,21 +6,32 @@ Code used in analysis shown in Indian Railways part I - travel to the Moon
 """
 
 
-from collections import Counter
+import shutil
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import matplotlib.pylab as plt
 import numpy as np
-import requests
 from bs4 import BeautifulSoup
 
+from downloader import make_session
 from helper import *
+from render import show
+from result_cache import cached_result
+from timetable import parse_distance
+from train_index import build_index
 
 DISTANCE_CUT_OFF = 27.71
 
+IRFCA_URL = "https://irfca.org/apps/station_codes?page="
+IRFCA_PAGES = 41  # There are 41 pages on that website
 
-def get_statistics() -> None:
+
+@cached_result
+def dataset_statistics() -> dict:
     """
-    Prints simple statistics about data set
+    Simple statistics about data set
+    :return: Dictionary with name and value of every statistic
     """
     data = get_data()
     count_train = Counter()
@@ -58,12 +69,21 @@ def get_statistics() -> None:
             else:
                 previous_count = r.distance
 
-    print("Number of entries: %d" % len(data))
-    print("Number of Trains: %d" % len(count_train))
-    print("Number of Origin Stations: %d" % len(count_source))
-    print("Number of Final Destinations: %d" % len(count_destination))
-    print("Number of Stations: %d" % len(count_stations))
-    print("Total Distance covered: %d" % run)
+    return OrderedDict([
+        ("Number of entries", len(data)),
+        ("Number of Trains", len(count_train)),
+        ("Number of Origin Stations", len(count_source)),
+        ("Number of Final Destinations", len(count_destination)),
+        ("Number of Stations", len(count_stations)),
+        ("Total Distance covered", run)])
+
+
+def get_statistics() -> None:
+    """
+    Prints simple statistics about data set
+    """
+    for name, value in dataset_statistics().items():
+        print("%s: %d" % (name, value))
 
 
 def stations_with_most_trains() -> None:
@@ -71,15 +91,16 @@ def stations_with_most_trains() -> None:
     Plots bar plot of stations visited by most number of trains
     :return:
     """
-    count = Counter()
-    for r in get_data():
-        count.update({r.station_name})
-
-    names = []
-    values = []
-    for c in count.most_common(10):
-        names.append(c[0])
-        values.append(c[1])
+    store = get_store()
+    index = build_index(store)
+    counts = index.train_counts()
+    top = np.argsort(-counts, kind="stable")[:10]
+    # Stations without stops have no name in the time table
+    top = top[index.indptr[top] < index.indptr[top + 1]]
+    # Name of station from its first stop
+    rows = store.stop_rows[index.positions[index.indptr[top]]]
+    names = list(store.values("station_name", rows))
+    values = counts[top].tolist()
 
     ind = np.arange(len(names))
 
@@ -89,7 +110,7 @@ def stations_with_most_trains() -> None:
     ax.set_yticks(ind)
     ax.set_xlabel("Number of unique train visits")
     ax.set_yticklabels([x.lower() for x in names])
-    plt.show()
+    show("stations_with_most_trains")
 
 
 def train_distance() -> None:
@@ -111,7 +132,7 @@ def train_distance() -> None:
     plt.ylabel("Number of trains")
     plt.xlabel("Travel Distance (in Km)")
     plt.legend(loc=0)
-    plt.show()
+    show("train_distance")
 
 
 def stations_with_cut_off() -> None:
@@ -121,8 +142,8 @@ def stations_with_cut_off() -> None:
     """
 
     count = Counter()
-    for r in get_full_trains():
-        if float(r.total_distance) > DISTANCE_CUT_OFF:
+    for r in iter_trains():
+        if parse_distance(r.total_distance) > DISTANCE_CUT_OFF:
             count.update({r.origin})
 
     names = []
@@ -139,7 +160,7 @@ def stations_with_cut_off() -> None:
     ax.set_yticks(ind)
     ax.set_xlabel("Number of unique long distance train visits")
     ax.set_yticklabels([x.lower() for x in names])
-    plt.show()
+    show("stations_with_cut_off")
 
 
 def stations_with_train_origin() -> None:
@@ -167,7 +188,7 @@ def stations_with_train_origin() -> None:
     ax.set_yticks(ind)
     ax.set_xlabel("Number of unique train origins")
     ax.set_yticklabels([x.lower() for x in names])
-    plt.show()
+    show("stations_with_train_origin")
 
 
 def stations_pairs() -> None:
@@ -193,10 +214,32 @@ def stations_pairs() -> None:
     ax.set_yticks(ind)
     ax.set_xlabel("Number of origin--destinations trains")
     ax.set_yticklabels([x.lower() for x in names])
-    plt.show()
+    show("stations_pairs")
 
 
-def download_station_data() -> None:
+def parse_station_page(text: str) -> list:
+    """
+    :param text: HTML of one page of https://irfca.org/apps/station_codes
+    :return: Lines for station file (values separated by ';')
+    """
+    new_soup = BeautifulSoup(text, 'html.parser')
+    table = new_soup.find("table", {"class": "zebra-striped"})
+    if table is None:
+        raise ValueError("Station table not found in page")
+    table_body = table.find("tbody")
+    lines = []
+    for row in table_body.find_all("tr"):
+        values = []
+        for col in row.find_all("td"):
+            values.append(col.text)
+
+        lines.append(";".join(values))
+    return lines
+
+
+def download_station_data(base_url: str = IRFCA_URL,
+                          last_page: int = IRFCA_PAGES, workers: int = 8,
+                          path: str = None, timeout: float = 30) -> None:
     """
     Station data is scrapped from https://irfca.org/apps/station_codes
 
@@ -208,33 +251,50 @@ def download_station_data() -> None:
     However lot of stations are hand curated.
     You can use scrip from "fetch_station_data.py" to extract geographical
     information regarding missing stations
-    """
-
-    last_page = 41  # There are 41 pages on that website
-    base_url = "https://irfca.org/apps/station_codes?page="
 
-    with open(STATION_DATA_FILE, "w") as f:
-        for i in range(last_page):
-            r = requests.get(base_url + str(i + 1))
-            new_soup = BeautifulSoup(r.text, 'html.parser')
-            table = new_soup.find("table", {"class": "zebra-striped"})
-            table_body = table.find("tbody")
-            for row in table_body.find_all("tr"):
-                values = []
-                for col in row.find_all("td"):
-                    values.append(col.text)
+    Pages are downloaded in parallel and every page is saved in a
+    checkpoint folder, so an interrupted download continues from where it
+    stopped. Station file is replaced only after all pages are downloaded.
 
-                print(";".join(values), file=f)
+    :param base_url: URL to which page number is appended (can point to
+    local server with recorded pages)
+    :param last_page: Number of pages (41 on that website)
+    :param workers: Number of parallel requests
+    :param path: Station file (default: STATION_DATA_FILE)
+    :param timeout: Timeout of every request in seconds
+    """
+    path = path or STATION_DATA_FILE
+    checkpoint_dir = path + ".pages"
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    session = make_session(workers)
+
+    def _page_file(page):
+        return os.path.join(checkpoint_dir, "%04d.txt" % page)
+
+    def _download(page):
+        if os.path.isfile(_page_file(page)):
+            return
+        r = session.get(base_url + str(page), timeout=timeout)
+        r.raise_for_status()
+        lines = parse_station_page(r.text)
+        atomic_write(_page_file(page), "".join(x + "\n" for x in lines))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() raises first error, finished pages stay in checkpoint
+        list(pool.map(_download, range(1, last_page + 1)))
+
+    all_lines = []
+    for page in range(1, last_page + 1):
+        with open(_page_file(page)) as f:
+            all_lines.append(f.read())
+    atomic_write(path, "".join(all_lines))
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
 
 
 def get_state_info():
-    stations = get_station_data()
-    data = get_data()
-    c = Counter()
-    for r in data:
-        try:
-            c.update({stations[str(r.station_code).strip()][2]})
-        except KeyError:
-            pass
+    index = get_station_index()
+    store = get_store()
+    states = index.state_ids_of(index.ids(store.station_codes))
+    c = state_counter(states[store.station_ids])
 
     print(c)
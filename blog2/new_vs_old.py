@@ -5,17 +5,24 @@ August 2018
 Code used in analysis shown in Indian Railways part II - Old versus New
 """
 
-from collections import Counter, defaultdict
+from collections import Counter
 
 import matplotlib.pylab as plt
 import numpy as np
 from colour import Color
 
+from connectivity import cached_matrix, connectivity_matrix
 from helper import *
+from parallel import map_trains
+from render import show
+from result_cache import cached_result
+
+# Created by state_connectivity(), labels are in file with .json extension
+STATE_MATRIX_FILE = "state_connectivity.npy"
 
 
 def train_distribution():
-    data = get_full_trains()
+    data = iter_trains()
     c = Counter()
     train_type = ["Special", "Long Distance", "Long Distance",
                   "Kolkata Suburban",
@@ -57,47 +64,52 @@ def train_distribution():
         ax.annotate(names[i], xy=(x, y), xytext=(1.35 * np.sign(x), 1.4 * y),
                     horizontalalignment=horizontalalignment, **kw)
 
-    plt.show()
+    show("train_distribution")
 
 
-def zone_wise_distribution():
-    data = get_full_trains()
+def _zone_counts(data) -> Counter:
+    """
+    Counts long distance and suburban trains by zone of their origin
+    :param data: List of FullTrain
+    :return: Counter with keys as (zone, "Long Distance" or "Suburban")
+    """
     station_data = get_station_data()
-
-    # Except sububan and passenger trains
-    division = ["0", "1", "2", "6", "7"]
-
-    zone_counter = Counter()
-    subdata = defaultdict(list)
-
+    c = Counter()
     for r in data:
         try:
             if len(r.train_number) == 5:
                 if r.origin_code in station_data.keys():
                     zone = station_data[r.origin_code][-1]
                     if len(zone.strip()) > 0:
-                        zone_counter.update({zone})
-                        subdata[zone].append(r)
+                        if is_long_distance(r.train_number):
+                            c.update({(zone, "Long Distance")})
+                        else:
+                            c.update({(zone, "Suburban")})
         except (TypeError, ValueError) as e:
             pass
+    return c
+
+
+@cached_result(ignore=("workers",))
+def zone_counts(workers: int = None) -> Counter:
+    """
+    :param workers: Number of processes, see parallel.map_reduce()
+    :return: See _zone_counts()
+    """
+    return map_trains(_zone_counts, workers)
+
+
+def zone_wise_distribution(workers: int = None):
+    c = zone_counts(workers)
 
     names = []
     values = []
     ld = "Long Distance"
     su = "Suburban"
-    for v in subdata:
-        temp = defaultdict(int)
-        for r in subdata[v]:
-            letter = str(r.train_number)[0]
-            if letter in division:
-                temp[ld] = temp[ld] + 1
-            else:
-                temp[su] = temp[su] + 1
-
-        temp_list = [temp[ld], temp[su]]
-
-        names.append(v)
-        values.append(temp_list)
+    for zone, _ in c:
+        if zone not in names:
+            names.append(zone)
+            values.append([c[(zone, ld)], c[(zone, su)]])
 
     fig, ax = plt.subplots()
 
@@ -126,44 +138,24 @@ def zone_wise_distribution():
            wedgeprops=dict(width=size, edgecolor='w'), startangle=90)
     print(sum(vals.flatten()))
     ax.set(aspect="equal")
-    plt.show()
+    show("zone_wise_distribution")
 
 
-def zonal_connectivity():
+@cached_result(ignore=("workers",))
+def zone_connectivity(workers: int = None) -> tuple:
     """
-    Warning: This function will take long time
-    Plots histogram of connectivity between zones
+    :param workers: Number of processes, see parallel.map_reduce()
+    :return: (matrix, list of zones)
     """
-    data = get_full_trains()
-    station_data = get_station_data()
+    return connectivity_matrix("zone", workers=workers)
 
-    c = Counter()
 
-    for z in station_data:
-        c.update({station_data[z][3]})
-
-    zone_list = []
-    for k in c:
-        if len(k) > 0:
-            zone_list.append(k)
-
-    zone_list.sort()
-    mat = np.zeros(shape=(len(zone_list), len(zone_list)))
-
-    for r in data:
-        if r.origin is not None:
-            try:
-                k = r.get_connection_pairs()
-                if [x in station_data.keys() for x in
-                    set(np.asarray(k).flatten())]:
-                    for pair in k:
-
-                        origin = zone_list.index(station_data[pair[0]][3])
-                        dest = zone_list.index(station_data[pair[1]][3])
-                        if origin != dest:
-                            mat[origin, dest] = mat[origin, dest] + 1
-            except (ValueError, KeyError):
-                pass
+def zonal_connectivity(workers: int = None):
+    """
+    Plots histogram of connectivity between zones
+    :param workers: Number of processes, see parallel.map_reduce()
+    """
+    mat, zone_list = zone_connectivity(workers)
 
     fig, ax = plt.subplots()
     heatmap = ax.pcolor(mat)
@@ -171,55 +163,26 @@ def zonal_connectivity():
     plt.yticks(np.arange(len(zone_list)) + 0.5, zone_list, rotation=45)
     ax.set(aspect="equal")
     plt.colorbar(heatmap)
-    plt.show()
+    show("zonal_connectivity")
 
 
-def state_wise_connectivity():
+def state_connectivity(workers: int = None) -> tuple:
     """
-    Warning: This function will take long time
-    Plots histogram of connectivity between States
+    Connectivity between states, saved in STATE_MATRIX_FILE and reused
+    until time table or station file changes
+    :param workers: Number of processes, see parallel.map_reduce()
+    :return: (matrix, list of states)
     """
-    data = get_full_trains()
-    station_data = get_station_data()
-
-    c = Counter()
-
-    reject_words = ["None", "BANG"]
-
-    for z in station_data:
-        if not (station_data[z][2] in reject_words):
-            c.update({station_data[z][2]})
-
-    state_list = []
-    for k in c:
-        if len(k) > 0:
-            state_list.append(k)
+    return cached_matrix(STATE_MATRIX_FILE, "state", ["None", "BANG"],
+                         workers)
 
-    state_list.sort()
-    mat = np.zeros(shape=(len(state_list), len(state_list)))
 
-    for r in data:
-        if r.origin is not None:
-            try:
-                k = r.get_connection_pairs()
-                if [x in station_data.keys() for x in
-                    set(np.asarray(k).flatten())]:
-                    for pair in k:
-
-                        origin = state_list.index(station_data[pair[0]][2])
-                        dest = state_list.index(station_data[pair[1]][2])
-                        if origin != dest:
-                            mat[origin, dest] = mat[origin, dest] + 1
-            except (ValueError, KeyError):
-                pass
-
-    with open("state_array.txt", "w") as f:
-        for line in mat:
-            print_text = ""
-            for k in line:
-                print_text += k + ","
-            print_text = print_text[:-1]
-            print(print_text, file=f)
+def state_wise_connectivity(workers: int = None):
+    """
+    Plots histogram of connectivity between States
+    :param workers: Number of processes, see parallel.map_reduce()
+    """
+    mat, state_list = state_connectivity(workers)
 
     fig, ax = plt.subplots()
     heatmap = ax.pcolor(mat, cmap='Purples_r', vmin=0.01)
@@ -230,35 +193,15 @@ def state_wise_connectivity():
     plt.ylabel("Destination State")
     plt.xlabel("Origin State")
     plt.colorbar(heatmap)
-    plt.show()
-
-
-def different_states_connected():
-    station_data = get_station_data()
-    c = Counter()
-    reject_words = ["None", "BANG"]
-    for z in station_data:
-        if not (station_data[z][2] in reject_words):
-            c.update({station_data[z][2]})
-
-    state_list = []
-    for k in c:
-        if len(k) > 0:
-            state_list.append(k)
-
-    state_list.sort()
+    show("state_wise_connectivity")
 
-    state_connectivity = []
-    with open("save.txt") as f:  # File created in state_wise_connectivity()
-        mat = []
-        for line in f:
-            line = [int(x) for x in line.split(",")]
-            mat.append(np.asarray(line))
-            state_connectivity.append(sum(np.asarray(line) > 0))
 
-    mat = np.asarray(mat)
+def different_states_connected(workers: int = None):
+    mat, state_list = state_connectivity(workers)
+    state_connectivity_count = [int(x) for x in (mat > 0).sum(axis=1)]
 
-    hh = {state_list[x]: state_connectivity[x] for x in range(len(mat))}
+    hh = {state_list[x]: state_connectivity_count[x]
+          for x in range(len(mat))}
     d = sorted(hh.items(), key=lambda x: x[1], reverse=True)
 
     names = []
@@ -279,7 +222,7 @@ def different_states_connected():
     ax.set_xlabel("Number of different states connected")
     ax.set_ylabel("State/Union Territory")
     ax.set_yticklabels([x for x in names])
-    plt.show()
+    show("different_states_connected")
 
 
 def run():
@@ -1,18 +1,15 @@
 import datetime
-from collections import OrderedDict, Counter, defaultdict
+from collections import OrderedDict, Counter
 
 import matplotlib
 import matplotlib.pylab  as plt
 import numpy as np
-import osmnx as ox
 
+from geometry import state_geometries
 from helper import *
-
-proxy = 'http://proxy.ncbs.res.in:3128'  # Your proxy, if any.
-os.environ['https_proxy'] = proxy
-os.environ['http_proxy'] = proxy
-
-ox.config(log_console=False, use_cache=True)
+from parallel import map_reduce, map_trains
+from render import ChoroplethRenderer, show
+from timetable import format_seconds
 
 # Following places are excluded from plotting because corresponding polygons
 # are not on scale and I was unable to make it in shape
@@ -27,33 +24,41 @@ def get_colors(values, start=0.3):
     return colors
 
 
-def plot_india_map(state_dict: dict):
-    all_states = []
+# Level of detail of state boundaries, see geometry.LEVELS_OF_DETAIL
+MAP_DETAIL = "medium"
+
+_map_renderers = {}
 
-    for k in state_dict:
-        all_states.append({"state": k})
 
+def map_renderer(states: tuple) -> ChoroplethRenderer:
+    """
+    Polygons are downloaded only once (see geometry.py) and figure is
+    reused by all maps with same states
+    :param states: Full names of states
+    :return: ChoroplethRenderer
+    """
+    if states not in _map_renderers:
+        _map_renderers[states] = ChoroplethRenderer(
+            state_geometries(list(states), MAP_DETAIL))
+    return _map_renderers[states]
+
+
+def plot_india_map(state_dict: dict, name: str = "india_map"):
     try:
         values = [x / max(state_dict.values()) for x in state_dict.values()]
     except ZeroDivisionError:
-        values = [0] * len(all_states)
+        values = [0] * len(state_dict)
 
-    places = ox.gdf_from_places(all_states)
-    places = ox.project_gdf(places)
-    ox.plot_shape(places, ec="w", fc=get_colors(values))
+    map_renderer(tuple(state_dict)).render(get_colors(values), name)
 
 
 def plot_most_stops():
-    stations = get_station_data()
-    data = get_data()
-    c = Counter()
-    a = 0
-    for r in data:
-        try:
-            c.update({stations[str(r.station_code).strip()][2]})
-            a += 1
-        except KeyError:
-            pass
+    index = get_station_index()
+    store = get_store()
+    # State of every station code and then of every row
+    states = index.state_ids_of(index.ids(store.station_codes))
+    c = state_counter(states[store.station_ids])
+    a = sum(c.values())
 
     print(c)
     print(a)
@@ -64,27 +69,15 @@ def plot_most_stops():
             if s[1] not in excluded_from_map:
                 all_states[s[1]] = c[s[2]]
 
-    plot_india_map(all_states)
+    plot_india_map(all_states, "plot_most_stops")
 
 
 def plot_most_stations():
-    stations = get_station_data()
-    data = get_data()
-    stations_codes = Counter()
-    a = 0
-    for r in data:
-        try:
-            stations_codes.update({r.station_code})
-        except KeyError:
-            pass
-
-    states = Counter()
-    for r in stations_codes:
-        try:
-            states.update({stations[str(r).strip()][2]})
-            a += 1
-        except KeyError:
-            pass
+    index = get_station_index()
+    store = get_store()
+    # Every station code appears only once in store.station_codes
+    states = state_counter(index.state_ids_of(index.ids(store.station_codes)))
+    a = sum(states.values())
     print(states)
     print(a)
     all_states = OrderedDict()
@@ -94,24 +87,28 @@ def plot_most_stations():
             if s[1] not in excluded_from_map:
                 all_states[s[1]] = states[s[2]]
 
-    plot_india_map(all_states)
+    plot_india_map(all_states, "plot_most_stations")
 
 
-def train_origin_data():
+def _origin_state_counts(data) -> Counter:
+    """
+    :param data: List of FullTrain
+    :return: Counter of states where long distance trains originate
+    """
     stations = get_station_data()
-    data = get_full_trains()
-
     c = Counter()
-    a = 0
     for r in data:
         try:
-            if len(r.train_number) == 5:
-                letter = str(r.train_number)[0]
-                if letter in ["0", "1", "2", "6", "7"]:
-                    c.update({stations[str(r.origin_code).strip()][2]})
-                    a += 1
-        except (TypeError, ValueError):
+            if is_long_distance(r.train_number):
+                c.update({stations[str(r.origin_code).strip()][2]})
+        except (TypeError, ValueError, KeyError):
             pass
+    return c
+
+
+def train_origin_data(workers: int = None):
+    c = map_trains(_origin_state_counts, workers)
+    a = sum(c.values())
 
     print(c)
     print(a)
@@ -122,7 +119,7 @@ def train_origin_data():
             if s[1] not in excluded_from_map:
                 all_states[s[1]] = c[s[2]]
 
-    plot_india_map(all_states)
+    plot_india_map(all_states, "train_origin_data")
 
 
 def inter_state_trains():
@@ -147,7 +144,7 @@ def inter_state_trains():
             if s[1] not in excluded_from_map:
                 all_states[s[1]] = c[s[2]]
 
-    plot_india_map(all_states)
+    plot_india_map(all_states, "inter_state_trains")
 
 
 class TimeHolder:
@@ -158,13 +155,15 @@ class TimeHolder:
         self.name = datetime_object.strftime('%I:%M %p')
 
     def check_slot(self):
-        for i in range(24):
-            if self.time.time() < datetime.time(hour=i):
-                return i
-        return 24
+        # Slot 'i' is from (i - 1):00 to i:00
+        return self.time.hour + 1
 
 
-def convert_slot(hour: int):
+def convert_slot(hour: int, bin_minutes: int = 60):
+    if bin_minutes != 60:
+        start = (hour - 1) * bin_minutes * 60
+        end = min(hour * bin_minutes * 60, 86400) % 86400
+        return format_seconds(start)[:5] + " - " + format_seconds(end)[:5]
     if hour != 24:
         d = datetime.time(hour=hour)
         d2 = datetime.time(hour=(hour - 1))
@@ -173,38 +172,31 @@ def convert_slot(hour: int):
         return "23:00 - 00:00"
 
 
-def train_departure_time():
-    data = get_full_trains()
-    c = Counter()
-    # for r in data:
-    #     try:
-    #         c.update(
-    #             {r.station_list[0].departure_time})  # First station departure
-    #     # c.update({r.station_list[-1].arrival_time})  # Last station arrival
-    #     except IndexError:
-    #         pass
-
-    # After removing local and suburbans
-    for r in data:
-        try:
-            if len(r.train_number) == 5:
-                letter = str(r.train_number)[0]
-                if letter in ["0", "1", "2", "6", "7"]:
-                    c.update(
-                        {r.station_list[
-                             0].departure_time})  # First station departure
-        #   c.update({r.station_list[-1].arrival_time})  # Last station arrival
-        except (IndexError, TypeError):
-            pass
-
-    object_holder = []
-    for k in c.most_common():
-        object_holder.append(TimeHolder(k[0], k[1]))
-
-    new_list = defaultdict(int)
-
-    for o in object_holder:
-        new_list[o.check_slot()] += o.value
+def _departure_histogram(store, start: int, stop: int,
+                         bin_minutes: int) -> np.ndarray:
+    """
+    :param store: TimetableStore
+    :param start: Index of first train
+    :param stop: Index after last train
+    :param bin_minutes: Width of time slot in minutes
+    :return: Histogram of departure time of long distance trains from their
+    first station
+    """
+    first = store.first_stops()[start:stop]
+    first = first[long_distance_rows(store, first)]
+    return store.time_histogram("departure", bin_minutes, first)
+
+
+def train_departure_time(bin_minutes: int = 60, workers: int = None):
+    """
+    Plots departure time of long distance trains from their first station
+    :param bin_minutes: Width of time slot in minutes
+    :param workers: Number of processes, see parallel.map_reduce()
+    """
+    hist = map_reduce(_departure_histogram, workers, args=(bin_minutes,))
+
+    # Same slot numbers as TimeHolder.check_slot() for hourly slots
+    new_list = {i + 1: int(x) for i, x in enumerate(hist) if x > 0}
 
     print(new_list)
     f = []
@@ -217,9 +209,9 @@ def train_departure_time():
     colors = []
 
     for t in f:
-        names.append(convert_slot(t[0]))
+        names.append(convert_slot(t[0], bin_minutes))
         values.append(t[1])
-        if t[0] < 13:
+        if (t[0] - 1) * bin_minutes < 12 * 60:
             colors.append("#f87eac")
         else:
             colors.append("#00baa1")
@@ -231,27 +223,23 @@ def train_departure_time():
     ax.set_yticks(ind)
     ax.set_xlabel("Frequency")
     ax.set_yticklabels([str(x) for x in names])
-    plt.show()
+    show("train_departure_time")
 
 
 def common_timings():
-    data = get_full_trains()
-    c = Counter()
-    for r in data:
-        try:
-            if len(r.train_number) == 5:
-                letter = str(r.train_number)[0]
-                if letter in ["0", "1", "2", "6", "7"]:
-                    # c.update(
-                    #     {r.station_list[
-                    #          0].departure_time})  # First station departure
-                    c.update({r.station_list[-1].arrival_time})  # Last station arrival
-        except (IndexError, TypeError):
-            pass
+    store = get_store()
+    last = store.last_stops()
+    last = last[long_distance_rows(store, last)]
+    # Number of trains arriving at every second of the day
+    arrivals = store.arrival[last]
+    arrivals = np.bincount(arrivals[arrivals >= 0], minlength=86400)
+    common = np.argsort(-arrivals, kind="stable")[:10]
 
     object_holder = []
-    for k in c.most_common(10):
-        object_holder.append(TimeHolder(k[0], k[1]))
+    for k in common:
+        if arrivals[k] > 0:
+            object_holder.append(TimeHolder(format_seconds(k),
+                                            int(arrivals[k])))
 
     object_holder.sort(key=lambda x: x.time, reverse=True)
     names = []
@@ -268,7 +256,7 @@ def common_timings():
     ax.set_yticks(ind)
     ax.set_xlabel("Frequency")
     ax.set_yticklabels([str(x) for x in names])
-    plt.show()
+    show("common_timings")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,254 @@
+"""
+Connectivity between groups of stations
+
+Every stop is mapped to an integer category (zone, state or any custom
+grouping) once. All ordered stop pairs of a train are generated with array
+operations and counted with np.bincount over flattened 'a * size + b'
+indices. Memory and time depend on number of pairs and not on number of
+categories. This gives same counts as going through all
+get_connection_pairs() of every train.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from helper import data_fingerprint, get_station_index, get_store
+from parallel import map_reduce
+from profiling import profiled, stage
+from stations import normalise_code
+
+# Number of stop pairs processed at once, limits memory of index arrays
+CHUNK_PAIRS = 1 << 22
+
+
+@profiled("connectivity.station_lookup")
+def station_categories(key, store, labels: list = None,
+                       reject=()) -> tuple:
+    """
+    Maps every station id of the store to a category
+    :param key: 'zone', 'state', dictionary {station code: label} or
+    function which takes station code and returns label (or None)
+    :param store: TimetableStore
+    :param labels: Order of categories (default: sorted labels)
+    :param reject: Labels which should be ignored
+    :return: (array with category of every station id or -1, labels)
+    """
+    if key in ("zone", "state"):
+        index = get_station_index()
+        ids = index.ids(store.station_codes)
+        if key == "zone":
+            names, label_ids = index.zones, index.zone_ids_of(ids)
+        else:
+            names, label_ids = index.states, index.state_ids_of(ids)
+    else:
+        if isinstance(key, dict):
+            mapping = {normalise_code(k): v for k, v in key.items()}
+            values = [mapping.get(normalise_code(x)) for x in
+                      store.station_codes]
+        else:
+            values = [key(x) for x in store.station_codes]
+        names = sorted({x for x in values if x is not None})
+        position = {x: i for i, x in enumerate(names)}
+        label_ids = np.asarray([position.get(x, -1) for x in values],
+                               dtype=np.int64)
+
+    if labels is None:
+        labels = sorted(x for x in names
+                        if x not in ("", None) and x not in reject)
+    label_index = {x: i for i, x in enumerate(labels)}
+    # Extra -1 at the end is picked by unknown (-1) labels
+    remap = np.asarray([label_index.get(x, -1) for x in names] + [-1],
+                       dtype=np.int64)
+    return remap[label_ids], labels
+
+
+def _pairs(lengths: np.ndarray) -> tuple:
+    """
+    :param lengths: Number of stops of every train, stops are contiguous
+    :return: (first, second) stop positions of all pairs with first before
+    second in the same train
+    """
+    ends = np.repeat(np.cumsum(lengths), lengths)
+    after = ends - np.arange(len(ends)) - 1  # Later stops of same train
+    first = np.repeat(np.arange(len(ends)), after)
+    starts = np.cumsum(after) - after
+    second = first + 1 + np.arange(len(first)) - np.repeat(starts, after)
+    return first, second
+
+
+def pair_counts(categories: np.ndarray, offsets: np.ndarray,
+                size: int) -> np.ndarray:
+    """
+    Counts ordered stop pairs of same train by category
+    :param categories: Category of every stop (negative if unknown), stops
+    of one train are contiguous
+    :param offsets: Start of every train in categories and end of last one
+    :param size: Number of categories
+    :return: Matrix where [a, b] is number of pairs in which stop of
+    category 'a' is followed by stop of category 'b' in the same train
+    """
+    counts = np.zeros(size * size, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    total = np.cumsum(lengths * (lengths - 1) // 2)
+    first = 0
+    while first < len(lengths):
+        done = total[first - 1] if first > 0 else 0
+        last = int(np.searchsorted(total, done + CHUNK_PAIRS, side="right"))
+        last = min(max(last, first + 1), len(lengths))
+        cats = np.asarray(categories[offsets[first]:offsets[last]],
+                          dtype=np.int64)
+        a, b = _pairs(lengths[first:last])
+        a, b = cats[a], cats[b]
+        known = (a >= 0) & (b >= 0)
+        counts += np.bincount(a[known] * size + b[known],
+                              minlength=size * size)
+        first = last
+
+    return counts.reshape(size, size).astype(np.float64)
+
+
+def _shard_pair_counts(store, start: int, stop: int, lookup: np.ndarray,
+                       size: int) -> np.ndarray:
+    offsets = store.train_offsets[start:stop + 1]
+    rows = store.stop_rows[offsets[0]:offsets[-1]]
+    return pair_counts(lookup[store.station_ids[rows]], offsets - offsets[0],
+                       size)
+
+
+def connectivity_matrix(key="zone", labels: list = None, reject=(),
+                        include_diagonal: bool = False,
+                        store=None, workers: int = None) -> tuple:
+    """
+    Number of possible origin-destination pairs between groups of stations
+    :param key: Grouping, see station_categories()
+    :param labels: Order of categories in the matrix (default: sorted
+    non-empty labels of all stations)
+    :param reject: Labels which should be ignored
+    :param include_diagonal: If True, pairs within same group are counted
+    :param store: TimetableStore (default: get_store())
+    :param workers: Number of processes, see parallel.map_reduce()
+    :return: (matrix, labels), matrix[origin, destination]
+    """
+    if store is None:
+        store = get_store()
+    lookup, labels = station_categories(key, store, labels, reject)
+    with stage("connectivity.pair_counts", rows=len(store.stop_rows)):
+        mat = map_reduce(_shard_pair_counts, workers, store,
+                         (lookup, len(labels)))
+    if not include_diagonal:
+        np.fill_diagonal(mat, 0)
+
+    return mat, labels
+
+
+def _sidecar(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def grouping_id(key, reject=(), name: str = None) -> dict:
+    """
+    :param key: Grouping, see station_categories()
+    :param reject: Labels which were ignored
+    :param name: Name of the grouping, needed when key is a lambda, local
+    function or other callable without unique qualified name
+    :return: JSON serialisable description of the grouping, saved with the
+    matrix so that matrix of other grouping is not reused
+    """
+    if name is not None:
+        key = {"name": name}
+    elif isinstance(key, dict):
+        items = sorted((normalise_code(k), str(v)) for k, v in key.items())
+        key = {"mapping": hashlib.sha1(
+            json.dumps(items).encode()).hexdigest()}
+    elif not isinstance(key, str):
+        qualname = getattr(key, "__qualname__", None)
+        if qualname is None or "<" in qualname:
+            # e.g. every lambda is '<lambda>'
+            raise ValueError("Grouping %r has no unique name, pass name of "
+                             "the grouping" % (key,))
+        key = {"function": "%s.%s" % (key.__module__, qualname)}
+    return {"key": key, "reject": sorted(str(x) for x in reject)}
+
+
+def save_matrix(path: str, mat: np.ndarray, labels: list,
+                source: dict = None, grouping: dict = None) -> None:
+    """
+    Saves matrix as .npy file and its labels in .json file with same name
+    :param path: Path of .npy file
+    :param mat: Square matrix
+    :param labels: Label of every row / column
+    :param source: Fingerprint of data used (default: data_fingerprint())
+    :param grouping: Result of grouping_id(), if known
+    """
+    if mat.shape != (len(labels), len(labels)):
+        raise ValueError("Matrix shape %s does not match %d labels" % (
+            mat.shape, len(labels)))
+    if source is None:
+        source = data_fingerprint()
+
+    temp = "%s.tmp-%d" % (path, os.getpid())
+    with open(temp, "wb") as f:
+        np.save(f, np.asarray(mat))
+    os.replace(temp, path)
+    temp = "%s.tmp-%d" % (_sidecar(path), os.getpid())
+    with open(temp, "w") as f:
+        json.dump({"labels": list(labels), "source": source,
+                   "grouping": grouping}, f)
+    os.replace(temp, _sidecar(path))
+
+
+def _load_sidecar(path: str) -> dict:
+    with open(_sidecar(path)) as f:
+        return json.load(f)
+
+
+def load_matrix(path: str, mmap: bool = True) -> tuple:
+    """
+    Loads matrix saved with save_matrix()
+    :param path: Path of .npy file
+    :param mmap: If True, matrix is memory mapped (read only)
+    :return: (matrix, labels, source)
+    """
+    meta = _load_sidecar(path)
+    mat = np.load(path, mmap_mode="r" if mmap else None)
+    if mat.shape != (len(meta["labels"]), len(meta["labels"])):
+        raise ValueError("Matrix in %s does not match its labels" % path)
+    return mat, meta["labels"], meta["source"]
+
+
+def matrix_grouping(path: str) -> dict:
+    """
+    :param path: Path of .npy file
+    :return: Grouping saved with the matrix (None if not known)
+    """
+    return _load_sidecar(path).get("grouping")
+
+
+def cached_matrix(path: str, key="zone", reject=(), workers: int = None,
+                  name: str = None) -> tuple:
+    """
+    Loads connectivity matrix from path if it was computed from current
+    data files with same grouping, otherwise computes and saves it
+    :param path: Path of .npy file
+    :param key: See connectivity_matrix()
+    :param reject: See connectivity_matrix()
+    :param workers: See connectivity_matrix()
+    :param name: See grouping_id()
+    :return: (matrix, labels)
+    """
+    source = data_fingerprint()
+    grouping = grouping_id(key, reject, name)
+    try:
+        mat, labels, saved = load_matrix(path)
+        if saved == source and matrix_grouping(path) == grouping:
+            return mat, labels
+    except (OSError, ValueError, KeyError):
+        pass
+
+    mat, labels = connectivity_matrix(key, reject=reject, workers=workers)
+    save_matrix(path, mat, labels, source, grouping)
+    return mat, labels
@@ -0,0 +1,231 @@
+"""
+Incremental updates of the time table
+
+Delta file has the same columns as the time table and contains all rows of
+added or modified trains. A line with only a train number removes that
+train, e.g.
+
+    12951,MUMBAI RAJDHANI,1,MMCT,MUMBAI CENTRAL,00:00:00,17:00:00,0,...
+    12951,MUMBAI RAJDHANI,2,BVI,BORIVALI,17:22:00,17:24:00,30,...
+    22222
+
+Aggregates which are sums over trains (Counters of map_trains() aggregators,
+connectivity matrices) are updated by subtracting contributions of removed
+or replaced trains and adding contributions of new trains, so cost depends
+on size of the delta and not on size of the time table.
+
+By default the new store exists only in this process: its fingerprint is
+derived from the old time table and the delta, and parallel.map_reduce()
+runs serially on it because workers can not open it. Give 'output' to
+apply_delta() to write the patched time table (CSV file and store cache).
+Aggregates saved under the new fingerprint (update_matrix(), put() of
+cached_result functions) are then reused by new processes which read the
+output file.
+"""
+
+import csv
+import hashlib
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+from connectivity import (grouping_id, load_matrix, pair_counts,
+                          save_matrix, station_categories)
+from helper import data_fingerprint, get_store, set_store, trains_from_store
+from parallel import merge
+from timetable import (COLUMNS, default_cache_dir, file_fingerprint,
+                       file_hash, is_header)
+
+
+class Delta:
+    """
+    Rows of added or modified trains and numbers of removed trains
+    """
+
+    def __init__(self, rows: list = None, removed=()):
+        self.rows = list(rows or [])
+        self.removed = set(removed)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "Delta":
+        """
+        :param path: Delta file (header is optional)
+        :return: Delta
+        """
+        delta = cls()
+        with open(path) as f:
+            for i, row in enumerate(csv.reader(f)):
+                values = [x for x in row if len(x.strip()) > 0]
+                if len(values) == 0:
+                    continue
+                if len(values) == 1:
+                    delta.removed.add(values[0].strip())
+                elif len(row) == len(COLUMNS):
+                    if i > 0 or not is_header(row):
+                        delta.rows.append(row)
+                else:
+                    raise ValueError("Line %d of %s has %d columns" % (
+                        i + 1, path, len(row)))
+        return delta
+
+    def fingerprint(self) -> str:
+        return hashlib.sha1(json.dumps(
+            [self.rows, sorted(self.removed)]).encode()).hexdigest()
+
+
+class Change:
+    """
+    Result of apply_delta(): old and new store with ids of changed trains
+    """
+
+    def __init__(self, old_store, new_store, old_trains: np.ndarray,
+                 new_trains: np.ndarray):
+        self.old_store = old_store
+        self.new_store = new_store
+        self.old_trains = old_trains  # Removed or replaced, in old_store
+        self.new_trains = new_trains  # Added or replaced, in new_store
+
+    def __len__(self):
+        return len(self.old_trains) + len(self.new_trains)
+
+
+def apply_delta(delta, store=None, path: str = None,
+                output: str = None) -> Change:
+    """
+    Applies delta to the store. When store is not given, shared store of
+    get_store() is updated, so later reports use new time table.
+    :param delta: Delta or path of delta file
+    :param store: TimetableStore (default: get_store(path))
+    :param path: Time table CSV file (default: TRAIN_DATA_FILE)
+    :param output: If given, patched time table is written to this CSV file
+    with its store cache, see write_store()
+    :return: Change
+    """
+    if isinstance(delta, str):
+        delta = Delta.from_csv(delta)
+    shared = store is None
+    if shared:
+        store = get_store(path)
+
+    new_store, old_trains, new_trains = store.apply_delta(delta.rows,
+                                                          delta.removed)
+    if output is not None:
+        write_store(new_store, output)
+    else:
+        # Results cached for old time table should not be reused
+        if store.source is not None:
+            base = store.source["sha1"]
+        else:
+            base = file_hash(store.path) if store.path is not None else ""
+        new_store.source = {"sha1": hashlib.sha1(
+            (base + delta.fingerprint()).encode()).hexdigest(),
+            "base": base}
+
+    if shared:
+        set_store(new_store, path)
+    return Change(store, new_store, old_trains, new_trains)
+
+
+def write_store(store, path: str) -> None:
+    """
+    Writes rows of the store as time table CSV file and saves the store as
+    its cache, so that other processes (also map_reduce() workers) load
+    same store with get_store(path)
+    :param store: TimetableStore, its path and fingerprint are updated
+    :param path: Output CSV file
+    """
+    temp = "%s.tmp-%d" % (path, os.getpid())
+    with open(temp, "w", newline="") as f:
+        writer = csv.writer(f)
+        if store.header is not None:
+            writer.writerow(store.header)
+        writer.writerows(store.rows())
+    os.replace(temp, path)
+    store.path = path
+    store.source = file_fingerprint(path)
+    cache_dir = default_cache_dir(path)
+    store.save(cache_dir)
+    store.cache_dir = cache_dir
+    set_store(store, path)
+
+
+def train_subset(store, trains: np.ndarray) -> list:
+    """
+    :param store: TimetableStore
+    :param trains: Train ids
+    :return: FullTrain models of given trains
+    """
+    result = []
+    for k in trains:
+        result.extend(trains_from_store(store, int(k), int(k) + 1))
+    return result
+
+
+def _subtract(first, second):
+    if isinstance(first, Counter):
+        result = first.copy()
+        result.subtract(second)
+        return type(first)({k: v for k, v in result.items() if v != 0})
+    if isinstance(first, (tuple, list)):
+        return type(first)(_subtract(x, y) for x, y in zip(first, second))
+    return first - second
+
+
+def update_aggregate(value, aggregator, change: Change):
+    """
+    :param value: aggregator(all trains) of the old time table, e.g. result
+    of map_trains()
+    :param aggregator: Function which takes list of FullTrain and returns
+    Counter or NumPy array (sum over trains)
+    :param change: Result of apply_delta()
+    :return: aggregator(all trains) of the new time table
+    """
+    old = aggregator(train_subset(change.old_store, change.old_trains))
+    new = aggregator(train_subset(change.new_store, change.new_trains))
+    return merge(_subtract(value, old), new)
+
+
+def _train_pair_counts(store, trains: np.ndarray, lookup: np.ndarray,
+                       size: int) -> np.ndarray:
+    offsets = store.train_offsets
+    rows = [store.stop_rows[offsets[k]:offsets[k + 1]] for k in trains]
+    lengths = [len(x) for x in rows]
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    return pair_counts(lookup[store.station_ids[rows]],
+                       np.concatenate(([0], np.cumsum(lengths))), size)
+
+
+def update_matrix(path: str, change: Change, key="zone", reject=(),
+                  include_diagonal: bool = False, source: dict = None,
+                  name: str = None):
+    """
+    Updates connectivity matrix saved with save_matrix(). Stations with
+    labels which are not in the saved matrix are ignored.
+    :param path: Path of .npy file
+    :param change: Result of apply_delta()
+    :param key: Grouping used for the matrix, see connectivity_matrix()
+    :param reject: See connectivity_matrix()
+    :param include_diagonal: See connectivity_matrix()
+    :param source: Fingerprint saved with the matrix (default: fingerprint
+    of the new store and current station file)
+    :param name: See connectivity.grouping_id()
+    :return: (matrix, labels)
+    """
+    grouping = grouping_id(key, reject, name)
+    mat, labels, _ = load_matrix(path, mmap=False)
+    # Station ids of old store are also valid in new store
+    lookup, labels = station_categories(key, change.new_store, labels,
+                                        reject)
+    size = len(labels)
+    mat = mat - _train_pair_counts(change.old_store, change.old_trains,
+                                   lookup, size)
+    mat += _train_pair_counts(change.new_store, change.new_trains, lookup,
+                              size)
+    if not include_diagonal:
+        np.fill_diagonal(mat, 0)
+    if source is None:
+        source = data_fingerprint(change.new_store)
+    save_matrix(path, mat, labels, source, grouping)
+    return mat, labels
@@ -0,0 +1,29 @@
+"""
+HTTP session for downloading data from web pages
+
+One pooled session is shared by all download threads. Failed requests
+(connection errors and 429 / 5xx responses) are retried with exponential
+backoff.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session(pool_size: int = 8, retries: int = 5,
+                 backoff: float = 0.5) -> requests.Session:
+    """
+    :param pool_size: Number of connections kept open per host
+    :param retries: Number of retries of every request
+    :param backoff: Backoff factor, waits backoff * 2 ^ (retry - 1) seconds
+    :return: Session with connection pool and retries
+    """
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -8,22 +8,26 @@ station code
 This script scraps data from website https://indiarailinfo.com
 
 On Windows: Keep 'gecodriver.exe' in the room folder
+
+Browser is started only when first station is searched. Lookups are done by
+a backend (SeleniumBackend for the website, HttpBackend for any server
+which returns the same pop-up HTML, e.g. local fake atlas for testing) and
+StationScraper runs several backends in parallel.
 """
 
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from numpy import random
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 
 STATION_DATA_FILE = "stations_data.txt"
 # Following file will have columns as (no, state name, acronym)
 STATE_NAMES_FILE = "states.csv"
 
+ATLAS_URL = "https://indiarailinfo.com/atlas"
+
 # Following list is needed to clean up station full form
 refine_list = ["Double Electric-Line",
                "Single Electric-Line",
@@ -37,91 +41,167 @@ refine_list = ["Double Electric-Line",
                "Narrow Gauge",
                "Construction - Diesel-Line Doubling"]
 
-# Initial setup for selenium
-profile = webdriver.FirefoxProfile()
-
-# You might want to change following if you are using proxy
-profile.set_preference('network.proxy.Kind', 'Direct')
-profile.set_preference('network.proxy.type', 0)
-
-driver = webdriver.Firefox(profile)
-driver.get("https://indiarailinfo.com/atlas")
+_state_names = None
 
 
 def get_state_names() -> dict:
     """
     Get list of states to convert state names to their acronyms
     Header : No, State Name, Acronym
+    File is read only once.
     :return: Dictionary with keys as full state name and values as acronym
     """
-    state_names = {}
-    with open(STATE_NAMES_FILE) as f:
-        for line in f:
-            state_names[line.strip().split(",")[1].strip().lower()] = \
-                line.strip(
+    global _state_names
+    if _state_names is None:
+        state_names = {}
+        with open(STATE_NAMES_FILE) as f:
+            for line in f:
+                s = line.strip().split(",")
+                state_names[s[1].strip().lower()] = s[2].strip()
+        _state_names = state_names
 
-                ).split(",")[2].strip()
+    return _state_names
 
-    return state_names
 
+def known_stations(path: str = STATION_DATA_FILE) -> set:
+    """
+    :param path: Station file
+    :return: Station codes which are already present in station file
+    """
+    codes = set()
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                code = line.strip().split(";")[0]
+                if len(code) > 0:
+                    codes.add(code)
+    return codes
 
-def human_type(element, text) -> None:
+
+def human_type(element, text, delay: float = 0.6) -> None:
     """
     Simulate human typing speed to avoid IP ban
     :param element: Input Element
     :param text: String
+    :param delay: Seconds per character
     """
     for char in text:
-        time.sleep(0.6)  # Average typing speed per second
+        time.sleep(delay)  # Average typing speed per second
         element.send_keys(char)
 
 
-def search(station_name):
+def parse_station_info(station_name: str, titles: list,
+                       labels: list) -> tuple:
     """
-    Search Station geographical information from https://indiarailinfo.com
-    :param station_name:
-    :return:
+    Extracts information from the pop-up shown for a station
+    :param station_name: Station code
+    :param titles: Text of all 'h2' elements in pop-up
+    :param labels: Text of all 'b' elements in pop-up
+    :return: (name, state, zone), None if not found
     """
     name, state, zone = None, None, None
     state_names = get_state_names()
 
-    # Refresh to reload HTML and all of its elements
-    driver.refresh()
-
-    try:
-        # First get input box
-        start_el = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "TrkStnListBox"))
-        )
-
-        # Once you get input box, start typing
-        human_type(start_el, station_name)
-        # Sleep for some random amount so that dropdown items will populate
-        time.sleep(random.uniform(0.5, 2))
-
-    except TimeoutException:
-        # If could not find input box, return and go to next
-        print(station_name + " :Too Slow Skipping")
-        return
-
-    try:
-        # Get drop down items
-        element = WebDriverWait(driver, 15).until(
-            EC.presence_of_element_located((By.CLASS_NAME, "dropdowntable"))
-        )
-
-        count = 1
-        station_fount = False
-        for m in element.find_elements_by_class_name("rcol"):
-            # Select only station which is same as query station
-            if m.text == station_name:
-                station_fount = True
-                break
-            else:
-                count += 1
-
-        # In station is found, go to that item and click enter
-        if station_fount:
+    # Scrap for state and zone
+    for k1 in titles:
+        sp = k1.split("/")
+        if sp[0] == station_name:
+            name = sp[1].split("(")[0].strip()
+            for text in refine_list:
+                name = name.replace(text, "")
+            name = name.strip()
+
+    for k2 in labels:
+        if k2.strip().lower() in state_names.keys():
+            state = state_names[k2.strip().lower()]
+
+        sp = k2.split("/")
+        if len(sp) > 1:
+            zone = sp[0]
+
+    return name, state, zone
+
+
+class SeleniumBackend:
+    """
+    Searches station on https://indiarailinfo.com/atlas with Firefox
+    """
+
+    def __init__(self, url: str = ATLAS_URL, typing_delay: float = 0.6):
+        self.url = url
+        self.typing_delay = typing_delay
+        self.driver = None
+
+    def start(self) -> None:
+        from selenium import webdriver
+
+        # Initial setup for selenium
+        profile = webdriver.FirefoxProfile()
+
+        # You might want to change following if you are using proxy
+        profile.set_preference('network.proxy.Kind', 'Direct')
+        profile.set_preference('network.proxy.type', 0)
+
+        self.driver = webdriver.Firefox(profile)
+        self.driver.get(self.url)
+
+    def lookup(self, station_name: str):
+        """
+        :param station_name: Station code
+        :return: (titles, labels) of the pop-up or None if not found
+        """
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        if self.driver is None:
+            self.start()
+        driver = self.driver
+
+        # Refresh to reload HTML and all of its elements
+        driver.refresh()
+
+        try:
+            # First get input box
+            start_el = WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.ID, "TrkStnListBox"))
+            )
+
+            # Once you get input box, start typing
+            human_type(start_el, station_name, self.typing_delay)
+            # Sleep for some random amount so that dropdown items will
+            # populate
+            time.sleep(random.uniform(0.5, 2))
+
+        except TimeoutException:
+            # If could not find input box, return and go to next
+            print(station_name + " :Too Slow Skipping")
+            return None
+
+        try:
+            # Get drop down items
+            element = WebDriverWait(driver, 15).until(
+                EC.presence_of_element_located(
+                    (By.CLASS_NAME, "dropdowntable"))
+            )
+
+            count = 1
+            station_fount = False
+            for m in element.find_elements_by_class_name("rcol"):
+                # Select only station which is same as query station
+                if m.text == station_name:
+                    station_fount = True
+                    break
+                else:
+                    count += 1
+
+            if not station_fount:
+                print(station_name + " :No Station Found")
+                return None
+
+            # In station is found, go to that item and click enter
             for c in range(count):
                 start_el.send_keys(Keys.DOWN)
 
@@ -130,50 +210,150 @@ def search(station_name):
             # Click button to show geographical informTION
             driver.find_element_by_id("SearchTrkStn").click()
             try:
-
                 # Wait till pop-up opens up
                 e = WebDriverWait(driver, 10).until(
                     EC.presence_of_element_located(
                         (By.CLASS_NAME, "leaflet-popup-content"))
                 )
-
-                # Scrap for state and zone
-                for k1 in e.find_elements_by_tag_name("h2"):
-                    sp = k1.text.split("/")
-                    if sp[0] == station_name:
-                        name = sp[1].split("(")[0].strip()
-                        for text in refine_list:
-                            name = name.replace(text, "")
-                        name = name.strip()
-
-                for k2 in e.find_elements_by_tag_name("b"):
-                    if k2.text.strip().lower() in state_names.keys():
-                        state = state_names[k2.text.strip().lower()]
-
-                    sp = k2.text.split("/")
-                    if len(sp) > 1:
-                        zone = sp[0]
-
-                # Save it in external file so that even if program is
-                # interrupted, you won't lose previously fetched data
-                # Remember to open with "a" mode else it will override
-                with open(STATION_DATA_FILE, "a") as fn:
-                    print(";".join([str(station_name), str(name), str(state),
-                                    str(zone)]), file=fn)
+                return ([x.text for x in e.find_elements_by_tag_name("h2")],
+                        [x.text for x in e.find_elements_by_tag_name("b")])
 
             except TimeoutException:
                 print(station_name + " :Can not find element")
-        else:
+        except TimeoutException:
+            print(station_name + " :Exiting")
+        return None
+
+    def close(self) -> None:
+        if self.driver is not None:
+            self.driver.close()
+            self.driver = None
+
+
+class HttpBackend:
+    """
+    Searches station on a server which returns pop-up HTML of the atlas for
+    GET <base_url>?station=<code> (404 if station is not known)
+    """
+
+    def __init__(self, base_url: str, session=None, timeout: float = 30):
+        from downloader import make_session
+        self.base_url = base_url
+        self.session = session or make_session()
+        self.timeout = timeout
+
+    def lookup(self, station_name: str):
+        """
+        :param station_name: Station code
+        :return: (titles, labels) of the pop-up or None if not found
+        """
+        from bs4 import BeautifulSoup
+
+        r = self.session.get(self.base_url,
+                             params={"station": station_name},
+                             timeout=self.timeout)
+        if r.status_code == 404:
             print(station_name + " :No Station Found")
-    except TimeoutException:
-        print(station_name + " :Exiting")
+            return None
+        r.raise_for_status()
+        soup = BeautifulSoup(r.text, "html.parser")
+        return ([x.text for x in soup.find_all("h2")],
+                [x.text for x in soup.find_all("b")])
+
+    def close(self) -> None:
+        pass
+
+
+class StationScraper:
+    """
+    Runs lookups with one backend per worker thread and appends results to
+    station file. Stations already present in the file are skipped.
+    """
+
+    def __init__(self, backend_factory=SeleniumBackend, workers: int = 1,
+                 path: str = STATION_DATA_FILE):
+        """
+        :param backend_factory: Function which returns new backend
+        :param workers: Number of backends used in parallel
+        :param path: Station file
+        """
+        self.backend_factory = backend_factory
+        self.workers = workers
+        self.path = path
+        self._local = threading.local()
+        self._backends = []
+        self._lock = threading.Lock()
+
+    def _backend(self):
+        if not hasattr(self._local, "backend"):
+            self._local.backend = self.backend_factory()
+            with self._lock:
+                self._backends.append(self._local.backend)
+        return self._local.backend
+
+    def search(self, station_name: str):
+        """
+        Search Station geographical information and save it in station file
+        :param station_name: Station code
+        :return: (name, state, zone) or None if not found
+        """
+        found = self._backend().lookup(station_name)
+        if found is None:
+            return None
+
+        name, state, zone = parse_station_info(station_name, *found)
+        # Save it in external file so that even if program is
+        # interrupted, you won't lose previously fetched data
+        # Remember to open with "a" mode else it will override
+        with self._lock:
+            with open(self.path, "a") as fn:
+                print(";".join([str(station_name), str(name), str(state),
+                                str(zone)]), file=fn)
+        return name, state, zone
+
+    def download_all(self, station_names) -> list:
+        """
+        :param station_names: List of stations
+        :return: Results of search() for stations not already in file
+        """
+        skip = known_stations(self.path)
+        pending = [x for x in dict.fromkeys(station_names) if x not in skip]
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                return list(pool.map(self.search, pending))
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for backend in self._backends:
+                backend.close()
+            self._backends = []
+        self._local = threading.local()
+
+
+_scraper = None
+
+
+def search(station_name):
+    """
+    Search Station geographical information from https://indiarailinfo.com
+    :param station_name:
+    :return:
+    """
+    global _scraper
+    if _scraper is None:
+        _scraper = StationScraper()
+    return _scraper.search(station_name)
 
 
-def download_all(station_names):
+def download_all(station_names, workers: int = 1, backend_factory=None):
     """
     Downloads all the station data and saves it in file
     :param station_names: List of stations
+    :param workers: Number of browsers used in parallel
+    :param backend_factory: Function which returns new backend (default:
+    SeleniumBackend)
     """
-    for k in station_names:
-        search(k)
-    driver.close()
+    scraper = StationScraper(backend_factory or SeleniumBackend, workers)
+    return scraper.download_all(station_names)
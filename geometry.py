@@ -0,0 +1,134 @@
+"""
+State boundaries used by map reports
+
+Polygons of states are geocoded with osmnx only once, projected, simplified
+(once more for every level of detail) and saved in STATE_BOUNDARY_FILE
+(pickled GeoDataFrame). Later maps read
+them from this file, so no network is needed. Any boundary file readable by
+geopandas (GeoPackage, shapefile, GeoJSON ...) with state names in one
+column can be used instead.
+"""
+
+import os
+
+from helper import STATES_DATA_FILE
+
+STATE_BOUNDARY_FILE = "state_boundaries.pkl"
+
+# Can be set to use own boundary file instead of osmnx
+BOUNDARY_FILE_ENV = "RAILWAY_BOUNDARY_FILE"
+
+# Simplification tolerance in meters (polygons are in projected CRS)
+SIMPLIFY_TOLERANCE = 500
+
+# Level of detail : extra simplification tolerance in meters
+LEVELS_OF_DETAIL = {"high": 0, "medium": 2000, "low": 5000}
+
+_boundaries = {}
+
+
+def all_state_names() -> list:
+    """
+    :return: Full names of all states from STATES_DATA_FILE
+    """
+    names = []
+    with open(STATES_DATA_FILE) as f:
+        for line in f:
+            names.append(line.strip().split(",")[1])
+    return names
+
+
+def fetch_state_boundaries(states: list,
+                           tolerance: float = SIMPLIFY_TOLERANCE):
+    """
+    Geocodes states with osmnx (needs network, set https_proxy environment
+    variable if you are behind proxy)
+    :param states: Full names of states
+    :param tolerance: Simplification tolerance in meters
+    :return: GeoDataFrame indexed by state name
+    """
+    import osmnx as ox
+
+    ox.config(log_console=False, use_cache=True)
+    places = ox.gdf_from_places([{"state": k} for k in states])
+    places = ox.project_gdf(places)
+    places["state"] = list(states)
+    places = places.set_index("state")
+    places["geometry"] = places.geometry.simplify(tolerance,
+                                                  preserve_topology=True)
+    return add_levels_of_detail(places[["geometry"]])
+
+
+def add_levels_of_detail(places):
+    """
+    Adds 'geometry_<level>' column for every level of LEVELS_OF_DETAIL
+    :param places: GeoDataFrame with 'geometry' column
+    :return: Same GeoDataFrame
+    """
+    for level, tolerance in LEVELS_OF_DETAIL.items():
+        column = "geometry_" + level
+        if column in places.columns:
+            continue
+        if tolerance > 0:
+            places[column] = places.geometry.simplify(
+                tolerance, preserve_topology=True)
+        else:
+            places[column] = places.geometry
+    return places
+
+
+def read_boundary_file(path: str, name_column: str = "state"):
+    """
+    :param path: Any file readable by geopandas
+    :param name_column: Column with full state names
+    :return: GeoDataFrame indexed by state name
+    """
+    import geopandas as gpd
+
+    places = gpd.read_file(path)
+    return add_levels_of_detail(places.set_index(name_column)[["geometry"]])
+
+
+def load_state_boundaries(states: list = None, path: str = None,
+                          boundary_file: str = None):
+    """
+    Polygons of states, loaded only once per process
+    :param states: Full names of states (default: all states)
+    :param path: Cache file (default: STATE_BOUNDARY_FILE)
+    :param boundary_file: Own boundary file, used instead of cache (default:
+    RAILWAY_BOUNDARY_FILE environment variable)
+    :return: GeoDataFrame indexed by state name, in order of states
+    """
+    import pandas as pd
+
+    boundary_file = boundary_file or os.environ.get(BOUNDARY_FILE_ENV)
+    source = boundary_file or path or STATE_BOUNDARY_FILE
+    places = _boundaries.get(source)
+
+    if places is None:
+        if boundary_file is not None:
+            places = read_boundary_file(boundary_file)
+        elif os.path.isfile(source):
+            places = add_levels_of_detail(pd.read_pickle(source))
+
+    if places is None or (boundary_file is None and states is not None and
+                          not set(states).issubset(places.index)):
+        places = fetch_state_boundaries(
+            sorted(set(all_state_names()) | set(states or [])))
+        places.to_pickle(source)
+
+    _boundaries[source] = places
+    if states is None:
+        return places
+    return places.loc[list(states)]
+
+
+def state_geometries(states: list, level: str = "medium", **kwargs) -> list:
+    """
+    :param states: Full names of states
+    :param level: One of LEVELS_OF_DETAIL
+    :param kwargs: Passed to load_state_boundaries()
+    :return: Shapely geometry of every state
+    """
+    places = load_state_boundaries(states, **kwargs)
+    return list(places["geometry_" + level])
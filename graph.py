@@ -0,0 +1,226 @@
+"""
+Station to station network built from the time table
+
+Every pair of consecutive stops of a train is an edge (from earlier stop to
+later stop). Parallel edges of different trains are merged, keeping the
+smallest distance and scheduled running time and the number of trains. The
+graph is stored in CSR form (indptr, indices and weight arrays) with
+station ids of stations.merge_codes() as nodes, so padded variants of a
+station code are one node.
+"""
+
+import heapq
+
+import numpy as np
+
+from helper import get_store
+from stations import merge_codes, normalise_code
+from train_index import StationTrainIndex, concat_ranges
+
+DAY = 86400  # Seconds
+
+
+class StationGraph:
+    """
+    CSR adjacency of stations
+
+    Neighbours of station 'i' are indices[indptr[i]:indptr[i + 1]] with
+    matching entries in 'distance' (km), 'duration' (seconds, inf if not
+    known) and 'trains' (number of trains running on the edge).
+    """
+
+    def __init__(self, store):
+        """
+        :param store: TimetableStore
+        """
+        self.codes, ids = merge_codes(store.station_codes)
+        self._id = {x: i for i, x in enumerate(self.codes)}
+        size = len(self.codes)
+
+        rows = store.stop_rows
+        stations = ids[store.station_ids[rows]]
+        # Stop 'p' and 'p + 1' are consecutive if they are in same train
+        last = np.zeros(len(rows), dtype=bool)
+        last[store.train_offsets[1:] - 1] = True
+        p = np.flatnonzero(~last[:-1]) if len(rows) > 0 else np.zeros(
+            0, dtype=np.int64)
+        src, dst = stations[p], stations[p + 1]
+
+        distance = store.distance[rows[p + 1]] - store.distance[rows[p]]
+        departure = store.departure[rows[p]].astype(np.float64)
+        arrival = store.arrival[rows[p + 1]].astype(np.float64)
+        duration = (arrival - departure) % DAY
+        duration[(departure < 0) | (arrival < 0)] = np.inf
+
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+        distance = np.maximum(distance[keep], 0)
+        duration = duration[keep]
+
+        # Merge parallel edges
+        key = src * size + dst
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+        first = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(
+            key) > 0 else np.zeros(0, dtype=np.int64)
+        self.indices = (key[first] % size).astype(np.int32)
+        if len(first) > 0:
+            self.distance = np.minimum.reduceat(distance[order], first)
+            self.duration = np.minimum.reduceat(duration[order], first)
+        else:
+            self.distance = np.zeros(0)
+            self.duration = np.zeros(0)
+        self.trains = np.diff(np.r_[first, len(key)]).astype(np.int32)
+        counts = np.bincount(key[first] // size, minlength=size)
+        self.indptr = np.r_[0, np.cumsum(counts)].astype(np.int64)
+
+        self.index = StationTrainIndex(store)
+        # Python lists are much faster than arrays in the Dijkstra loop
+        self._adjacency = (self.indptr.tolist(), self.indices.tolist())
+        self._lists = {x: self._weights(x).tolist()
+                       for x in ("distance", "duration", "hops")}
+
+    @property
+    def size(self) -> int:
+        return len(self.codes)
+
+    def id(self, station) -> int:
+        """
+        :param station: Station code or id
+        :return: Station id
+        """
+        if isinstance(station, (int, np.integer)):
+            return int(station)
+        return self._id[normalise_code(station)]
+
+    def neighbours(self, station) -> np.ndarray:
+        """
+        :param station: Station code or id
+        :return: Station ids which are next stop of any train
+        """
+        i = self.id(station)
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def _weights(self, weight: str) -> np.ndarray:
+        if weight == "distance":
+            return self.distance
+        if weight == "duration":
+            return self.duration
+        if weight == "hops":
+            return np.ones(len(self.indices))
+        raise ValueError("Unknown weight '%s'" % weight)
+
+    def _dijkstra(self, source: int, weight: str, target: int = None):
+        indptr, indices = self._adjacency
+        if weight not in self._lists:
+            self._weights(weight)  # Raises ValueError
+        weights = self._lists[weight]
+        cost = [np.inf] * self.size
+        previous = [-1] * self.size
+        done = [False] * self.size
+        cost[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            c, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            if u == target:
+                break
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nc = c + weights[e]
+                if nc < cost[v]:
+                    cost[v] = nc
+                    previous[v] = u
+                    heapq.heappush(heap, (nc, v))
+        return np.asarray(cost), previous
+
+    def shortest_path(self, source, target, weight: str = "distance"):
+        """
+        :param source: Station code or id
+        :param target: Station code or id
+        :param weight: 'distance', 'duration' or 'hops'
+        :return: (cost, list of station codes), (inf, []) if not reachable
+        """
+        s, t = self.id(source), self.id(target)
+        cost, previous = self._dijkstra(s, weight, t)
+        if not np.isfinite(cost[t]):
+            return np.inf, []
+        path = [t]
+        while path[-1] != s:
+            path.append(int(previous[path[-1]]))
+        return float(cost[t]), [self.codes[x] for x in reversed(path)]
+
+    def shortest_costs(self, sources, weight: str = "distance") -> np.ndarray:
+        """
+        Bulk single source shortest paths (uses SciPy when available)
+        :param sources: Station codes or ids
+        :param weight: 'distance', 'duration' or 'hops'
+        :return: Array (len(sources), size) of costs (inf if not reachable)
+        """
+        sources = [self.id(x) for x in sources]
+        weights = self._weights(weight)
+        try:
+            from scipy.sparse import csr_matrix
+            from scipy.sparse.csgraph import dijkstra
+        except ImportError:
+            return np.asarray([self._dijkstra(s, weight)[0]
+                               for s in sources]).reshape(len(sources),
+                                                          self.size)
+
+        usable = np.isfinite(weights)
+        # Zero weights would be dropped by csr_matrix
+        data = np.where(usable, np.maximum(weights, 1e-9), 0)
+        mat = csr_matrix((data, self.indices, self.indptr),
+                         shape=(self.size, self.size))
+        mat.eliminate_zeros()
+        return dijkstra(mat, directed=True, indices=sources)
+
+    def k_hop(self, source, k: int) -> np.ndarray:
+        """
+        :param source: Station code or id
+        :param k: Maximum number of hops
+        :return: Sorted station ids reachable in at most k hops (including
+        source)
+        """
+        seen = np.zeros(self.size, dtype=bool)
+        frontier = np.asarray([self.id(source)])
+        seen[frontier] = True
+        for _ in range(k):
+            nxt = self.indices[concat_ranges(self.indptr[frontier],
+                                             self.indptr[frontier + 1])]
+            frontier = np.unique(nxt[~seen[nxt]])
+            if len(frontier) == 0:
+                break
+            seen[frontier] = True
+        return np.flatnonzero(seen)
+
+    def k_hop_many(self, sources, k: int) -> np.ndarray:
+        """
+        :param sources: Station codes or ids
+        :param k: Maximum number of hops
+        :return: Boolean matrix (len(sources), size), True where reachable
+        """
+        reach = np.zeros((len(sources), self.size), dtype=bool)
+        for i, s in enumerate(sources):
+            reach[i, self.k_hop(s, k)] = True
+        return reach
+
+    def direct_reachable(self, source) -> np.ndarray:
+        """
+        :param source: Station code or id
+        :return: Sorted station ids reachable from source without changing
+        trains
+        """
+        return self.index.reachable(self.id(source))
+
+
+def build_graph(store=None) -> StationGraph:
+    """
+    :param store: TimetableStore (default: get_store())
+    :return: StationGraph
+    """
+    if store is None:
+        store = get_store()
+    return StationGraph(store)
@@ -1,5 +1,13 @@
 import csv
 import os
+import sys
+from collections import Counter
+
+import numpy as np
+
+from profiling import profiled
+from stations import StationIndex
+from timetable import TimetableStore, file_hash
 
 # Can be downloaded with 'download_station_data()' function
 STATION_DATA_FILE = "stations_data.txt"
@@ -9,26 +17,48 @@ TRAIN_DATA_FILE = "Train_details_22122017.csv"
 
 STATES_DATA_FILE = "states.csv"
 
+# First digit of 5 digit number of long distance trains (except suburban and
+# passenger trains)
+LONG_DISTANCE = ["0", "1", "2", "6", "7"]
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
 
 class Train:
     """
     Simple class to access structured data
+
+    Uses __slots__ and interned strings, so rows of same station or train
+    share their strings and there is no per row dictionary.
     """
 
+    __slots__ = ("number", "name", "seq", "station_code", "station_name",
+                 "arrival_time", "departure_time", "distance",
+                 "source_station", "source_station_name",
+                 "destination_station", "destination_station_name")
+
     def __init__(self, data):
-        self.data = data
-        self.number = data[0]
-        self.name = data[1]
-        self.seq = data[2]  # Station Number from start
-        self.station_code = data[3]
-        self.station_name = data[4]
-        self.arrival_time = data[5]
-        self.departure_time = data[6]
-        self.distance = data[7]
-        self.source_station = data[8]
-        self.source_station_name = data[9]
-        self.destination_station = data[10]
-        self.destination_station_name = data[11]
+        self.number = _intern(data[0])
+        self.name = _intern(data[1])
+        self.seq = _intern(data[2])  # Station Number from start
+        self.station_code = _intern(data[3])
+        self.station_name = _intern(data[4])
+        self.arrival_time = _intern(data[5])
+        self.departure_time = _intern(data[6])
+        self.distance = _intern(data[7])
+        self.source_station = _intern(data[8])
+        self.source_station_name = _intern(data[9])
+        self.destination_station = _intern(data[10])
+        self.destination_station_name = _intern(data[11])
+
+    @property
+    def data(self) -> list:
+        """
+        Row as it was in the CSV file
+        """
+        return [getattr(self, x) for x in self.__slots__]
 
 
 class FullTrain:
@@ -44,6 +74,7 @@ class FullTrain:
         self.destination = None
         self.destination_code = None
         self._station_list = []
+        self._station_ids = None
         self.total_distance = 0
 
     @property
@@ -54,6 +85,16 @@ class FullTrain:
     def station_list(self) -> list:
         return self._station_list
 
+    @property
+    def station_ids(self) -> np.ndarray:
+        """
+        Interned station codes (see TimetableStore.station_ids)
+        """
+        if self._station_ids is None:
+            raise ValueError("Station ids are only available for trains "
+                             "loaded from TimetableStore")
+        return self._station_ids
+
     def add_station(self, train: Train):
         if self.origin is None:
             self.origin = train.source_station_name
@@ -69,70 +110,265 @@ class FullTrain:
     def is_same_train(self, train: Train):
         return train.number == self.train_number
 
+    def connection_indices(self) -> tuple:
+        """
+        Positions of all possible source and destinations
+        :return: Two arrays (i, k) with i < k
+        """
+        return np.triu_indices(len(self._station_list), 1)
+
+    def connection_id_pairs(self) -> tuple:
+        """
+        Vectorized version of get_connection_pairs
+        :return: Two arrays with station ids of sources and destinations
+        """
+        i, k = self.connection_indices()
+        return self.station_ids[i], self.station_ids[k]
+
+    def iter_connection_pairs(self, as_ids: bool = False):
+        """
+        Lazily yields pairs of possible source and destinations
+        :param as_ids: If True, yields station ids instead of codes
+        """
+        stations = self.station_ids.tolist() if as_ids else self.stations
+        for i in range(len(stations)):
+            for k in range(i + 1, len(stations)):
+                yield stations[i], stations[k]
+
     def get_connection_pairs(self) -> list:
         """
         Returns pairs of possible source and destinations
         """
-        all_pairs = []
-        for i in range(len(self.stations)):
-            while i < len(self.stations):
-                for k in range(i, len(self.stations)):
-                    if i != k:
-                        if [i, k] not in all_pairs:
-                            all_pairs.append([i, k])
-                i += 1
+        return [[x, y] for x, y in self.iter_connection_pairs()]
 
-        return [[self.stations[x], self.stations[y]]
-                for [x, y] in all_pairs]
 
+# Parsed time tables, key is absolute path of CSV file
+_stores = {}
 
-def get_data() -> list:
+
+@profiled("helper.get_store", rows=len)
+def get_store(path: str = None, use_cache: bool = True) -> TimetableStore:
     """
-    Converts CSV file into Train models
+    Parses time table only once per process. By default parsed columns are
+    also kept in memory mapped cache next to the CSV file (see
+    TimetableStore.cached) so that new processes can skip parsing.
+    :param path: Time table CSV file (default: TRAIN_DATA_FILE)
+    :param use_cache: If False, on-disk cache is neither read nor written
+    :return: Shared TimetableStore
+    """
+    key = os.path.abspath(path or TRAIN_DATA_FILE)
+    if key not in _stores:
+        if use_cache:
+            _stores[key] = TimetableStore.cached(key)
+        else:
+            _stores[key] = TimetableStore.from_csv(key)
+        report = _stores[key].report
+        if report:
+            print("Problems in %s:\n%s" % (key, report.summary()),
+                  file=sys.stderr)
+    return _stores[key]
+
+
+def set_store(store: TimetableStore, path: str = None) -> None:
+    """
+    Replaces shared store returned by get_store(), e.g. after applying
+    time table delta
+    :param store: New TimetableStore
+    :param path: Time table CSV file (default: TRAIN_DATA_FILE)
+    """
+    _stores[os.path.abspath(path or TRAIN_DATA_FILE)] = store
+
+
+def is_long_distance(number: str) -> bool:
+    """
+    :param number: Train number
+    :return: True if train is long distance train
+    """
+    return len(number) == 5 and number[0] in LONG_DISTANCE
+
+
+def long_distance_rows(store: TimetableStore, rows: np.ndarray) -> np.ndarray:
+    """
+    :param store: TimetableStore
+    :param rows: Row indices
+    :return: Boolean mask, True where row belongs to a long distance train
+    """
+    numbers = np.asarray([is_long_distance(x) for x in store.train_numbers],
+                         dtype=bool)
+    return numbers[store.train_ids[rows]]
+
+
+@profiled("helper.trains_from_store", rows=len)
+def trains_from_store(store: TimetableStore, start: int = 0,
+                      stop: int = None) -> list:
+    """
+    Builds FullTrain models for range of trains in the store
+    :param store: TimetableStore
+    :param start: Index of first train
+    :param stop: Index after last train (default: all trains)
+    :return: List of FullTrain
     """
+    if stop is None:
+        stop = store.n_trains
+    offsets = store.train_offsets
+    rows = store.stop_rows[offsets[start]:offsets[stop]]
+    all_rows = store.rows(rows)
     all_trains = []
-    with open(TRAIN_DATA_FILE) as f:
-        c = csv.reader(f)
-        for row in c:
-            all_trains.append(Train(row))
+    for k in range(start, stop):
+        t = FullTrain()
+        a = offsets[k] - offsets[start]
+        b = offsets[k + 1] - offsets[start]
+        for row in all_rows[a:b]:
+            t.add_station(Train(row))
+        t._station_ids = store.station_ids[rows[a:b]]
+        all_trains.append(t)
     return all_trains
 
 
+@profiled("helper.get_data", rows=len)
+def get_data() -> list:
+    """
+    Converts CSV file into Train models
+    """
+    store = get_store()
+    all_rows = store.rows()
+    if store.header is not None:
+        all_rows.insert(0, store.header)
+    return [Train(row) for row in all_rows]
+
+
+@profiled("helper.get_full_trains", rows=len)
 def get_full_trains() -> list:
     """
     Converts CSV file into Train models
     """
+    store = get_store()
     all_trains = []
-    with open(TRAIN_DATA_FILE) as f:
-        c = csv.reader(f)
-        for row in c:
-            if len(all_trains) == 0:
-                all_trains.append(FullTrain())
+    if len(store) > 0 or store.header is not None:
+        # Empty first train is kept for compatibility with earlier output
+        all_trains.append(FullTrain())
+    all_trains.extend(trains_from_store(store))
+    return all_trains
+
+
+def iter_trains(path: str = None):
+    """
+    Streams FullTrain models directly from CSV file. Only one train is kept
+    in memory, so it can be used on files which do not fit in memory (e.g.
+    several time tables concatenated together). Rows are accepted with
+    same rules as in TimetableStore, see ingest.row_problem().
+    :param path: Time table CSV file (default: TRAIN_DATA_FILE)
+    """
+    from ingest import row_problem
 
+    current = None
+    with open(path or TRAIN_DATA_FILE) as f:
+        for row in csv.reader(f):
+            if len(row) == 0 or row_problem(row) is not None:
+                # Header is rejected as well (invalid seq)
+                continue
             t = Train(row)
-            try:
-                float(t.distance)
-                if all_trains[-1].is_same_train(t):
-                    all_trains[-1].add_station(t)
-                else:
-                    all_trains.append(FullTrain())
-                    all_trains[-1].add_station(t)
-            except ValueError:
-                pass
-    return all_trains
+            if current is None or not current.is_same_train(t):
+                if current is not None:
+                    yield current
+                current = FullTrain()
+            current.add_station(t)
+    if current is not None:
+        yield current
 
 
-def get_station_data() -> dict:
-    station_dict = {}
-    if os.path.isfile(STATION_DATA_FILE):
-        with open(STATION_DATA_FILE) as f:
-            for line in f:
-                station_dict[line.strip().split(";")[0]] = line.strip().split(
-                    ";")
+# Parsed STATION_DATA_FILE, see get_station_index()
+_station_index = None
+
+
+@profiled("helper.get_station_index", rows=len)
+def get_station_index() -> StationIndex:
+    """
+    Parses station file only once per process
+    :return: Shared StationIndex
+    """
+    global _station_index
+    if _station_index is None:
+        if not os.path.isfile(STATION_DATA_FILE):
+            raise Exception(
+                "You need station file ("
+                + STATION_DATA_FILE + ") for this. Use "
+                                      "'download_station_data( )' before "
+                                      "using this")
+        _station_index = StationIndex.from_file(STATION_DATA_FILE)
+    return _station_index
+
+
+def reload_station_index() -> StationIndex:
+    """
+    Forces next get_station_index() to read station file again
+    :return: New StationIndex
+    """
+    global _station_index
+    _station_index = None
+    return get_station_index()
+
+
+def state_counter(state_ids: np.ndarray) -> Counter:
+    """
+    :param state_ids: Array of state ids from StationIndex (-1 if unknown)
+    :return: Counter with state acronym as key
+    """
+    states = get_station_index().states
+    counts = np.bincount(state_ids[state_ids >= 0], minlength=len(states))
+    return Counter({states[i]: int(x) for i, x in enumerate(counts) if x})
+
+
+# Content hashes, key is (absolute path, size, modification time)
+_file_hashes = {}
+
+
+def cached_file_hash(path: str) -> str:
+    """
+    :param path: Any file
+    :return: SHA1 of file content, calculated again only when size or
+    modification time of the file changes
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _file_hashes:
+        _file_hashes[key] = file_hash(path)
+    return _file_hashes[key]
+
+
+def data_fingerprint(store: TimetableStore = None) -> dict:
+    """
+    :param store: TimetableStore (default: get_store())
+    :return: Content hashes of time table and station file, results
+    computed from these files can be reused as long as they do not change
+    """
+    if store is None:
+        store = get_store()
+    if store.source is not None:
+        timetable = store.source["sha1"]
     else:
-        raise Exception(
-            "You need station file ("
-            + STATION_DATA_FILE + ") for this. Use 'download_station_data( "
-                                  ")' before using this")
+        timetable = cached_file_hash(store.path)
+    return {"timetable": timetable,
+            "stations": cached_file_hash(STATION_DATA_FILE)}
+
+
+def atomic_write(path: str, text: str) -> None:
+    """
+    Writes text in temporary file and renames it, so readers never see half
+    written file
+    :param path: Destination file
+    :param text: Content
+    """
+    temp = "%s.tmp-%d" % (path, os.getpid())
+    with open(temp, "w") as f:
+        f.write(text)
+    os.replace(temp, path)
+
 
-    return station_dict
+@profiled("helper.get_station_data", rows=len)
+def get_station_data() -> dict:
+    """
+    :return: Dictionary with station code as key and list of fields of
+    station file (code, name, state, zone) as value
+    """
+    return {values[0]: values for values in get_station_index().fields}
@@ -0,0 +1,386 @@
+"""
+Fast ingest of the time table CSV file
+
+File is read in large blocks by the multi-threaded CSV reader of pyarrow
+(dictionary encoded columns), or in chunks by the C parser of pandas
+(pd.factorize per chunk), or with pure Python csv.reader when neither is
+installed. Values are validated once per unique value instead of once per
+row:
+
+    * rows with missing trailing fields, without train number or station
+      code, or with non-integer SEQ are rejected
+    * malformed times and non-numeric distances ('NA') are kept and coerced
+      to MISSING / NaN by TimetableStore, their counts are reported
+
+Lines with too many fields are skipped and reported. CSV reader of pyarrow
+skips and reports lines with missing fields as malformed lines instead of
+rejecting them. Accepted rows are same with every engine and same as
+rows accepted by row_problem(), which checks one line of csv.reader.
+
+    python ingest.py Train_details_22122017.csv --report rejected.csv
+"""
+
+import argparse
+import csv
+import re
+import warnings
+from collections import Counter
+from importlib import import_module
+
+import numpy as np
+
+from timetable import (COLUMNS, MISSING, is_header, parse_distance,
+                       parse_int, parse_seconds)
+
+CHUNK_ROWS = 1 << 20
+
+MISSING_FIELDS = "missing fields"
+
+
+def _blank(value: str) -> bool:
+    return len(value.strip()) == 0
+
+
+# (column, reason, check) of validate(), check(value) is True if the row
+# is rejected
+ROW_CHECKS = (
+    ("number", "missing train number", _blank),
+    ("seq", "invalid seq", lambda x: parse_int(x) == MISSING),
+    ("station_code", "missing station code", _blank))
+
+
+def row_problem(row: list):
+    """
+    Checks one line of the time table with same rules as validate()
+    :param row: Fields of the line given by csv.reader
+    :return: Reason why the row is not accepted or None
+    """
+    size = len(COLUMNS)
+    if len(row) > size:
+        return "expected %d fields, saw %d" % (size, len(row))
+    if len(row) < size:
+        return MISSING_FIELDS
+    for column, reason, check in ROW_CHECKS:
+        if check(row[COLUMNS.index(column)]):
+            return reason
+    return None
+
+
+class IngestReport:
+    """
+    Problems found while reading the time table
+    """
+
+    def __init__(self):
+        self.rows = 0  # Accepted rows
+        self.malformed = []  # (line number or None, message) skipped
+        self.rejected = []  # (data row number, reason, values)
+        self.coerced = Counter()  # Column : rows with unusable value
+
+    def __bool__(self):
+        return len(self.malformed) + len(self.rejected) > 0
+
+    def summary(self) -> str:
+        lines = ["%d rows accepted, %d rejected, %d malformed lines" % (
+            self.rows, len(self.rejected), len(self.malformed))]
+        for reason, count in Counter(x[1] for x in self.rejected).items():
+            lines.append("  rejected (%s): %d" % (reason, count))
+        for column, count in sorted(self.coerced.items()):
+            lines.append("  coerced %s: %d" % (column, count))
+        return "\n".join(lines)
+
+    def write_csv(self, path: str) -> None:
+        """
+        :param path: Output file with one line per rejected row or line
+        """
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "row", "reason"] + list(COLUMNS))
+            for line, message in self.malformed:
+                writer.writerow(["" if line is None else line, "", message])
+            for row, reason, values in self.rejected:
+                writer.writerow(["", row, reason] + list(values))
+
+
+def _read_arrow(path: str, report: IngestReport) -> tuple:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+
+    header = None
+    with open(path) as f:
+        for row in csv.reader(f):
+            if len(row) > 0:
+                if is_header(row + [""] * (len(COLUMNS) - len(row))):
+                    header = row
+                break
+
+    def _invalid(row):
+        # Line number is not known when file is read by several threads
+        report.malformed.append((row.number, "expected %d fields, saw %d: "
+                                 "%s" % (row.expected_columns,
+                                         row.actual_columns, row.text)))
+        return "skip"
+
+    text = pa.dictionary(pa.int32(), pa.string())
+    table = pa_csv.read_csv(
+        path,
+        read_options=pa_csv.ReadOptions(
+            column_names=list(COLUMNS), skip_rows=int(header is not None),
+            block_size=1 << 24),
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=_invalid),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={c: text for c in COLUMNS},
+            strings_can_be_null=False, quoted_strings_can_be_null=False))
+    table = table.unify_dictionaries()
+
+    codes, categories = {}, {}
+    for c in COLUMNS:
+        column = table.column(c)
+        if column.num_chunks == 0:
+            codes[c] = np.zeros(0, dtype=np.int32)
+            categories[c] = []
+            continue
+        column = column.combine_chunks()
+        codes[c] = column.indices.to_numpy(
+            zero_copy_only=False).astype(np.int32)
+        categories[c] = column.dictionary.to_pylist()
+    # Lines with missing fields are already skipped
+    return header, codes, categories, np.zeros(0, dtype=np.int64)
+
+
+def _first_appearance(codes: np.ndarray, categories: list) -> tuple:
+    """
+    Renumbers codes in order of first appearance (same as the other
+    engines) and drops unused categories
+    :return: (codes, categories)
+    """
+    first = np.full(len(categories), len(codes), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    order = np.argsort(first, kind="stable")
+    order = order[first[order] < len(codes)]
+    remap = np.zeros(len(categories), dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
+    return remap[codes], [categories[i] for i in order]
+
+
+def _short_lines(path: str, rows: np.ndarray) -> np.ndarray:
+    """
+    Missing trailing fields are read as empty strings by pandas, same as
+    empty fields, so fields of the candidate rows are counted again
+    :param path: Time table CSV file
+    :param rows: Sorted candidate rows (including header) as numbered by
+    pandas, blank lines and lines with too many fields are not counted
+    :return: Candidate rows with missing fields
+    """
+    size = len(COLUMNS)
+    short = []
+    k = 0
+    last = int(rows[-1])
+    with open(path) as f:
+        for row in csv.reader(f):
+            if len(row) == 0 or (len(row) == 1 and _blank(row[0])) or \
+                    len(row) > size:
+                continue
+            if len(row) < size:
+                short.append(k)
+            if k == last:
+                break
+            k += 1
+    return np.intersect1d(np.asarray(short, dtype=np.int64), rows)
+
+
+def _read_pandas(path: str, chunk_rows: int, report: IngestReport) -> tuple:
+    import pandas as pd
+
+    tables = [{} for _ in COLUMNS]
+    parts = [[] for _ in COLUMNS]
+    header = None
+    first = True
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        # Columns are parsed directly into categoricals, so strings of
+        # every row are never created
+        reader = pd.read_csv(path, header=None, names=range(len(COLUMNS)),
+                             dtype="category", keep_default_na=False,
+                             na_filter=False, on_bad_lines="warn",
+                             chunksize=chunk_rows, low_memory=False,
+                             engine="c")
+        for chunk in reader:
+            skip = 0
+            if first:
+                first = False
+                row = [str(chunk[i].iloc[0]) for i in range(len(COLUMNS))] \
+                    if len(chunk) > 0 else None
+                if row is not None and is_header(row):
+                    header = row
+                    skip = 1
+            for i, table in enumerate(tables):
+                column = chunk[i]
+                remap = np.fromiter(
+                    (table.setdefault(str(u), len(table))
+                     for u in column.cat.categories.tolist()),
+                    dtype=np.int32, count=len(column.cat.categories))
+                parts[i].append(remap[column.cat.codes.to_numpy()[skip:]])
+
+    for w in caught:
+        for line, message in re.findall(r"line (\d+): ([^\n]*)",
+                                        str(w.message)):
+            report.malformed.append((int(line), message))
+    codes, categories = {}, {}
+    for i, c in enumerate(COLUMNS):
+        values = np.concatenate(parts[i]) if parts[i] else \
+            np.zeros(0, dtype=np.int32)
+        codes[c], categories[c] = _first_appearance(values, list(tables[i]))
+
+    # Last field of a line with missing fields is always empty
+    short = np.zeros(0, dtype=np.int64)
+    if "" in categories[COLUMNS[-1]]:
+        skip = int(header is not None)
+        rows = np.flatnonzero(codes[COLUMNS[-1]] == categories[
+            COLUMNS[-1]].index(""))
+        short = _short_lines(path, rows + skip) - skip
+    return header, codes, categories, short
+
+
+def _read_python(path: str, report: IngestReport) -> tuple:
+    tables = [{} for _ in COLUMNS]
+    codes = [[] for _ in COLUMNS]
+    short = []
+    header = None
+    first = True
+    size = len(COLUMNS)
+    with open(path) as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if len(row) == 0:
+                continue
+            if first:
+                first = False
+                if is_header(row + [""] * (size - len(row))):
+                    header = row
+                    continue
+            if len(row) > size:
+                report.malformed.append((
+                    reader.line_num, "expected %d fields, saw %d" % (
+                        size, len(row))))
+                continue
+            if len(row) < size:
+                # Rejected by validate(), padded for the report
+                short.append(len(codes[0]))
+                row = row + [""] * (size - len(row))
+            for i in range(size):
+                table = tables[i]
+                codes[i].append(table.setdefault(row[i], len(table)))
+
+    return header, {c: np.asarray(codes[i], dtype=np.int32)
+                    for i, c in enumerate(COLUMNS)}, \
+        {c: list(tables[i]) for i, c in enumerate(COLUMNS)}, \
+        np.asarray(short, dtype=np.int64)
+
+
+def _bad_rows(codes: np.ndarray, categories: list, check) -> np.ndarray:
+    """
+    :return: Boolean mask of rows for which check(value) is True
+    """
+    bad = np.asarray([check(x) for x in categories] + [False], dtype=bool)
+    return bad[codes] if len(codes) > 0 else np.zeros(0, dtype=bool)
+
+
+def validate(codes: dict, categories: dict, report: IngestReport,
+             short: np.ndarray = None) -> tuple:
+    """
+    Removes rejected rows, see module documentation
+    :param codes: Column : integer codes of rows
+    :param categories: Column : unique values
+    :param report: Rejected rows and coerced values are added to it
+    :param short: Rows which had missing fields (padded with empty strings)
+    :return: (codes, categories) of accepted rows
+    """
+    rejected = np.zeros(len(codes["number"]), dtype=bool)
+    if short is not None:
+        rejected[short] = True
+        for row in short:
+            report.rejected.append((int(row) + 1, MISSING_FIELDS, [
+                categories[c][codes[c][row]] for c in COLUMNS]))
+    for column, reason, check in ROW_CHECKS:
+        bad = _bad_rows(codes[column], categories[column], check) & \
+              ~rejected
+        for row in np.flatnonzero(bad):
+            report.rejected.append((int(row) + 1, reason, [
+                categories[c][codes[c][row]] for c in COLUMNS]))
+        rejected |= bad
+    report.rejected.sort(key=lambda x: x[0])
+
+    if rejected.any():
+        keep = ~rejected
+        codes = {c: codes[c][keep] for c in COLUMNS}
+        # Values used only by rejected rows are dropped
+        for c in COLUMNS:
+            used = np.zeros(len(categories[c]), dtype=bool)
+            used[codes[c]] = True
+            if not used.all():
+                codes[c] = (np.cumsum(used) - 1).astype(np.int32)[codes[c]]
+                categories[c] = [x for x, u in zip(categories[c], used) if u]
+
+    for column in ("arrival_time", "departure_time"):
+        report.coerced[column] += int(_bad_rows(
+            codes[column], categories[column],
+            lambda x: parse_seconds(x) == MISSING).sum())
+    report.coerced["distance"] += int(_bad_rows(
+        codes["distance"], categories["distance"],
+        lambda x: np.isnan(parse_distance(x))).sum())
+    report.rows = len(codes["number"])
+    return codes, categories
+
+
+def read_timetable(path: str, engine: str = None,
+                   chunk_rows: int = CHUNK_ROWS) -> tuple:
+    """
+    :param path: Time table CSV file
+    :param engine: 'pyarrow', 'pandas' or 'python' (default: first one
+    which is installed)
+    :param chunk_rows: Rows parsed at once by pandas
+    :return: (header or None, codes, categories, IngestReport), codes and
+    categories are dictionaries keyed by column, see TimetableStore
+    """
+    if engine is None:
+        engine = "python"
+        for name, module in (("pyarrow", "pyarrow.csv"),
+                             ("pandas", "pandas")):
+            try:
+                import_module(module)
+                engine = name
+                break
+            except ImportError:
+                pass
+
+    report = IngestReport()
+    if engine == "pyarrow":
+        header, codes, categories, short = _read_arrow(path, report)
+    elif engine == "pandas":
+        header, codes, categories, short = _read_pandas(path, chunk_rows,
+                                                        report)
+    elif engine == "python":
+        header, codes, categories, short = _read_python(path, report)
+    else:
+        raise ValueError("Unknown engine '%s'" % engine)
+    codes, categories = validate(codes, categories, report, short)
+    return header, codes, categories, report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate time table")
+    parser.add_argument("path", help="Time table CSV file")
+    parser.add_argument("--report", default=None,
+                        help="Write rejected rows to this CSV file")
+    parser.add_argument("--engine", choices=["pyarrow", "pandas", "python"],
+                        default=None)
+    args = parser.parse_args(argv)
+    report = read_timetable(args.path, args.engine)[3]
+    print(report.summary())
+    if args.report is not None:
+        report.write_csv(args.report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Earliest arrival journey planner (Connection Scan Algorithm)
+
+Every pair of consecutive stops of a train is a connection. Times of a train
+are unwrapped over midnight (multi-day trains) and all trains are assumed to
+run daily, so connections are repeated for every day of the planning horizon.
+Connections are sorted by departure once, queries only scan them.
+
+Changing trains at a station needs at least its transfer time. Stations are
+identified by stations.merge_codes(), so a train can be changed between
+padded variants of a station code.
+"""
+
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from helper import get_store
+from stations import merge_codes, normalise_code
+from timetable import MISSING, format_seconds, parse_seconds
+
+DAY = 86400  # Seconds
+TRANSFER_TIME = 5 * 60  # Default minimum time to change trains (seconds)
+INF = float("inf")
+
+
+def unwrap_times(store) -> tuple:
+    """
+    Converts times of the day into seconds since midnight of the day on
+    which train departs from its first stop
+    :param store: TimetableStore
+    :return: (arrival, departure, valid) arrays for every stop in
+    store.stop_rows order
+    """
+    rows = store.stop_rows
+    offsets = store.train_offsets
+    times = np.stack([store.arrival[rows], store.departure[rows]],
+                     axis=1).astype(np.int64)
+    # Arrival at first stop and departure from last stop are placeholders
+    times[offsets[:-1], 0] = times[offsets[:-1], 1]
+    times[offsets[1:] - 1, 1] = times[offsets[1:] - 1, 0]
+    for a, b in ((0, 1), (1, 0)):
+        missing = times[:, a] == MISSING
+        times[missing, a] = times[missing, b]
+    valid = times[:, 0] != MISSING
+
+    # Both times missing: repeat previous time to keep days in order
+    flat = times.ravel()
+    known = np.where(flat != MISSING, np.arange(len(flat)), 0)
+    flat = flat[np.maximum.accumulate(known)] if len(flat) > 0 else flat
+
+    wraps = np.r_[0, np.cumsum(flat[1:] < flat[:-1])]
+    start = np.repeat(wraps[2 * offsets[:-1]], 2 * np.diff(offsets))
+    flat = flat + DAY * (wraps - start)
+    times = flat.reshape(-1, 2)
+    return times[:, 0], times[:, 1], valid
+
+
+class JourneyPlanner:
+    """
+    Sorted connection arrays of the whole network
+
+    Connection 'i' leaves station dep_station[i] at dep_time[i] and reaches
+    arr_station[i] at arr_time[i] with trip trip[i] (one train on one day).
+    Times are seconds since midnight of the first day of the horizon.
+    """
+
+    def __init__(self, store, days: int = 2,
+                 transfer_time: int = TRANSFER_TIME, transfers: dict = None):
+        """
+        :param store: TimetableStore
+        :param days: Planning horizon, journeys can depart on first day and
+        arrive till the end of the horizon
+        :param transfer_time: Minimum time to change trains (seconds)
+        :param transfers: Station code : transfer time, overrides
+        transfer_time for these stations
+        """
+        self.codes, ids = merge_codes(store.station_codes)
+        self._id = {x: i for i, x in enumerate(self.codes)}
+        self.days = days
+
+        self.transfer = np.full(len(self.codes), transfer_time,
+                                dtype=np.int64)
+        for code, value in (transfers or {}).items():
+            self.transfer[self.id(code)] = value
+
+        rows = store.stop_rows
+        offsets = store.train_offsets
+        arrival, departure, valid = unwrap_times(store)
+        stations = ids[store.station_ids[rows]]
+        train = np.repeat(np.arange(store.n_trains), np.diff(offsets))
+        self.train_numbers = [store.train_numbers[x] for x in
+                              store.train_ids[rows[offsets[:-1]]]]
+
+        last = np.zeros(len(rows), dtype=bool)
+        last[offsets[1:] - 1] = True
+        p = np.flatnonzero(~last)
+        p = p[valid[p] & valid[p + 1] & (stations[p] != stations[p + 1])]
+        dep, arr = departure[p], arrival[p + 1]
+
+        # One copy of every connection for every day of the horizon
+        span = int(arr.max() // DAY) + 1 if len(p) > 0 else 1
+        copies = span + days
+        first_day = dep // DAY
+        dep_time, arr_time, trip, index = [], [], [], []
+        for day in range(days):
+            shift = DAY * (day - first_day)
+            dep_time.append(dep + shift)
+            arr_time.append(arr + shift)
+            trip.append(train[p] * copies + (day - first_day + span))
+            index.append(p)
+        dep_time = np.concatenate(dep_time)
+        arr_time = np.concatenate(arr_time)
+        order = np.lexsort((arr_time, dep_time))
+
+        self.dep_time = dep_time[order]
+        self.arr_time = arr_time[order]
+        self.trip = np.concatenate(trip)[order]
+        stop = np.concatenate(index)[order]
+        self.dep_station = stations[stop]
+        self.arr_station = stations[stop + 1]
+        self.n_trips = store.n_trains * copies
+        self._copies = copies
+
+        # Plain lists are much faster than arrays in the scan loops
+        self._lists = (self.dep_time.tolist(), self.arr_time.tolist(),
+                       self.dep_station.tolist(), self.arr_station.tolist(),
+                       self.trip.tolist(), self.transfer.tolist())
+
+    def __len__(self):
+        return len(self.dep_time)
+
+    def id(self, station) -> int:
+        """
+        :param station: Station code or id
+        :return: Station id
+        """
+        if isinstance(station, (int, np.integer)):
+            return int(station)
+        return self._id[normalise_code(station)]
+
+    def train_number(self, trip: int) -> str:
+        return self.train_numbers[trip // self._copies]
+
+    def _scan(self, source: int, departure: int, target: int = None,
+              max_duration: int = None):
+        dep_time, arr_time, dep_station, arr_station, trips, transfer = \
+            self._lists
+        arrival = [INF] * len(self.codes)
+        ready = [INF] * len(self.codes)  # Earliest time to board next train
+        via = [None] * len(self.codes)
+        boarded = {}
+        arrival[source] = ready[source] = departure
+
+        end = departure + (max_duration or self.days * DAY)
+        for i in range(bisect_left(dep_time, departure), len(dep_time)):
+            d = dep_time[i]
+            if d >= end or (target is not None and d >= arrival[target]):
+                break
+            trip = trips[i]
+            board = boarded.get(trip)
+            if board is None:
+                if ready[dep_station[i]] > d:
+                    continue
+                board = boarded[trip] = i
+            a = arr_time[i]
+            s = arr_station[i]
+            if a < arrival[s]:
+                arrival[s] = a
+                ready[s] = a + transfer[s]
+                via[s] = (board, i)
+        return arrival, via
+
+    def earliest_arrival(self, source, departure,
+                         max_duration: int = None) -> np.ndarray:
+        """
+        Single source earliest arrival to all stations
+        :param source: Station code or id
+        :param departure: Departure time (seconds or 'HH:MM:SS')
+        :param max_duration: Only journeys shorter than this (seconds) are
+        searched, smaller values make query faster (default: horizon)
+        :return: Earliest arrival time at every station id (seconds since
+        midnight of departure day, inf if not reachable within horizon)
+        """
+        arrival, _ = self._scan(self.id(source), _seconds(departure),
+                                max_duration=max_duration)
+        return np.asarray(arrival, dtype=np.float64)
+
+    def journey(self, source, target, departure) -> list:
+        """
+        :param source: Station code or id
+        :param target: Station code or id
+        :param departure: Departure time (seconds or 'HH:MM:SS')
+        :return: Legs of earliest arriving journey as list of (train number,
+        from station, departure, to station, arrival), times in seconds since
+        midnight of departure day. Empty if target is not reachable.
+        """
+        s, t = self.id(source), self.id(target)
+        arrival, via = self._scan(s, _seconds(departure), target=t)
+        legs = []
+        station = t
+        while station != s and via[station] is not None:
+            board, alight = via[station]
+            legs.append((self.train_number(self.trip[board]),
+                         self.codes[self.dep_station[board]],
+                         int(self.dep_time[board]),
+                         self.codes[station], int(self.arr_time[alight])))
+            station = int(self.dep_station[board])
+        return legs[::-1] if station == s else []
+
+    def profile(self, source, target) -> list:
+        """
+        All journeys which are not dominated by another journey (departing
+        later and arriving earlier), for departures on the first day
+        :param source: Station code or id
+        :param target: Station code or id
+        :return: List of (departure, arrival) in seconds, sorted by departure
+        """
+        s, t = self.id(source), self.id(target)
+        dep_time, arr_time, dep_station, arr_station, trips, transfer = \
+            self._lists
+        # Profile of every station : negative departures (increasing) and
+        # arrivals at target (decreasing)
+        departures = [[] for _ in self.codes]
+        arrivals = [[] for _ in self.codes]
+        trip_arrival = {}
+
+        for i in range(len(dep_time) - 1, -1, -1):
+            station = arr_station[i]
+            if station == t:
+                best = arr_time[i]
+            else:
+                best = trip_arrival.get(trips[i], INF)
+                changes = departures[station]
+                if changes:
+                    k = bisect_right(changes,
+                                     -(arr_time[i] + transfer[station]))
+                    if k > 0 and arrivals[station][k - 1] < best:
+                        best = arrivals[station][k - 1]
+            if best == INF:
+                continue
+            if best < trip_arrival.get(trips[i], INF):
+                trip_arrival[trips[i]] = best
+
+            station = dep_station[i]
+            if station == t:
+                continue
+            found = arrivals[station]
+            if not found or best < found[-1]:
+                if departures[station] and departures[station][-1] == \
+                        -dep_time[i]:
+                    found[-1] = best
+                else:
+                    departures[station].append(-dep_time[i])
+                    found.append(best)
+
+        return [(-d, a) for d, a in zip(reversed(departures[s]),
+                                        reversed(arrivals[s])) if -d < DAY]
+
+
+def _seconds(value) -> int:
+    if isinstance(value, str):
+        seconds = parse_seconds(value)
+        if seconds == MISSING:
+            raise ValueError("Malformed time '%s'" % value)
+        return seconds
+    return int(value)
+
+
+def format_journey(legs: list) -> list:
+    """
+    :param legs: Result of JourneyPlanner.journey()
+    :return: Printable lines, times as 'HH:MM:SS (+days)'
+    """
+    lines = []
+    for number, start, dep, end, arr in legs:
+        lines.append("%s : %s %s (+%d) -> %s %s (+%d)" % (
+            number, start, format_seconds(dep % DAY), dep // DAY, end,
+            format_seconds(arr % DAY), arr // DAY))
+    return lines
+
+
+def build_planner(store=None, **kwargs) -> JourneyPlanner:
+    """
+    :param store: TimetableStore (default: get_store())
+    :param kwargs: Passed to JourneyPlanner
+    :return: JourneyPlanner
+    """
+    if store is None:
+        store = get_store()
+    return JourneyPlanner(store, **kwargs)
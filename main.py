@@ -16,9 +16,77 @@ This data file is not included in this repository to avoid redistribution
 issues (if any). You can download from above link.
 
 Code used in different blog posts are in respective folders
+
+Reports can be run from command line, e.g.
+    python main.py report zonal_connectivity plot_most_stops --output out
+    python main.py report --list
 """
 
-from blog2.new_vs_old import run
+import argparse
+
+import helper
+import profiling
+import render
+from reports import REPORTS, run_reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Indian Railway data visualization")
+    commands = parser.add_subparsers(dest="command")
+    report = commands.add_parser("report", help="Run one or more reports")
+    report.add_argument("names", nargs="*", help="Names of reports")
+    report.add_argument("--list", action="store_true",
+                        help="List available reports")
+    report.add_argument("--all", action="store_true",
+                        help="Run all reports")
+    report.add_argument("--workers", type=int, default=None,
+                        help="Number of processes")
+    report.add_argument("--output", default=None,
+                        help="Save figures in this folder instead of "
+                             "showing them")
+    report.add_argument("--format", action="append", default=None,
+                        help="Figure format (png, svg, pdf), can be repeated")
+    report.add_argument("--data", default=helper.TRAIN_DATA_FILE,
+                        help="Time table CSV file")
+    report.add_argument("--stations", default=helper.STATION_DATA_FILE,
+                        help="Station data file")
+    report.add_argument("--profile", default=None, metavar="DIR",
+                        help="Record timings of stages and cProfile "
+                             "statistics of reports in this folder")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        # Earlier default of this script
+        from blog2.new_vs_old import run
+        run()
+        return
+
+    if args.list:
+        for name in REPORTS:
+            print(name)
+        return
+
+    names = list(REPORTS) if args.all else args.names
+    if len(names) == 0:
+        parser.error("Give report names, --all or --list")
+    unknown = [x for x in names if x not in REPORTS]
+    if len(unknown) > 0:
+        parser.error("Unknown reports: " + ", ".join(unknown))
+
+    helper.TRAIN_DATA_FILE = args.data
+    helper.STATION_DATA_FILE = args.stations
+    if args.output is not None:
+        render.configure(args.output, args.format or ["png"])
+
+    if args.profile is not None:
+        profiling.enable(args.profile, cprofile=True)
+    try:
+        run_reports(names, args.workers)
+    finally:
+        if args.profile is not None:
+            profiling.write_all(args.profile)
+
 
 if __name__ == "__main__":
-    run()
+    main()
@@ -0,0 +1,118 @@
+"""
+Parallel map-reduce over trains of the time table
+
+Trains are split into contiguous shards of roughly equal number of stops.
+Every worker process opens the time table the same way as the parent
+(memory mapped cache, so it is cheap, or the CSV file when the parent does
+not use the cache) and aggregates its shard. Results are merged in
+shard order, hence Counter ordering and matrix values are same as in the
+serial run.
+"""
+
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from helper import get_store, trains_from_store
+from timetable import TimetableStore, default_cache_dir
+
+# Shards per worker, more shards give better load balance
+SHARDS_PER_WORKER = 4
+
+
+def merge(first, second):
+    """
+    Merges two partial results
+    :param first: Counter, NumPy array, tuple / list of those or None
+    :param second: Same type as first
+    :return: Merged result
+    """
+    if first is None:
+        return second
+    if second is None:
+        return first
+    if isinstance(first, Counter):
+        first.update(second)
+        return first
+    if isinstance(first, np.ndarray):
+        return first + second
+    if isinstance(first, (tuple, list)):
+        return type(first)(merge(x, y) for x, y in zip(first, second))
+    return first + second
+
+
+def shard_ranges(store, shards: int) -> list:
+    """
+    :param store: TimetableStore
+    :param shards: Number of shards
+    :return: List of (start, stop) train ranges with similar number of stops
+    """
+    offsets = store.train_offsets
+    if store.n_trains == 0:
+        return []
+    targets = np.linspace(0, offsets[-1], shards + 1)[1:-1]
+    cuts = np.searchsorted(offsets, targets)
+    bounds = np.unique(np.concatenate(([0], cuts, [store.n_trains])))
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _worker_store(path: str, cache_dir: str) -> TimetableStore:
+    if cache_dir is None or cache_dir == default_cache_dir(path):
+        return get_store(path, use_cache=cache_dir is not None)
+    return TimetableStore.cached(path, cache_dir)
+
+
+def _run_shard(func, path, cache_dir, start, stop, args):
+    return func(_worker_store(path, cache_dir), start, stop, *args)
+
+
+def map_reduce(func, workers: int = None, store=None, args=()):
+    """
+    Runs func(store, start, stop, *args) for shards of trains and merges
+    results. func and args should be picklable (module level function).
+    :param func: Aggregator for trains[start:stop]
+    :param workers: Number of processes (None or 1 runs in this process,
+    0 uses all CPUs). Stores without CSV file (e.g. result of
+    delta.apply_delta() without output) are always processed in this
+    process.
+    :param store: TimetableStore (default: get_store())
+    :param args: Extra arguments passed to func
+    :return: Merged result
+    """
+    if store is None:
+        store = get_store()
+    if workers == 0:
+        workers = os.cpu_count()
+    if workers is None or workers <= 1 or store.path is None:
+        return func(store, 0, store.n_trains, *args)
+
+    ranges = shard_ranges(store, workers * SHARDS_PER_WORKER)
+    if len(ranges) < 2:
+        return func(store, 0, store.n_trains, *args)
+
+    result = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_shard, func, store.path,
+                               store.cache_dir, a, b, args)
+                   for a, b in ranges]
+        for f in futures:
+            result = merge(result, f.result())
+    return result
+
+
+def _train_shard(store, start, stop, aggregator):
+    return aggregator(trains_from_store(store, start, stop))
+
+
+def map_trains(aggregator, workers: int = None, store=None):
+    """
+    Parallel version of aggregator(get_full_trains())
+    :param aggregator: Module level function which takes list of FullTrain
+    and returns Counter or NumPy array
+    :param workers: See map_reduce()
+    :param store: TimetableStore (default: get_store())
+    :return: Merged result
+    """
+    return map_reduce(_train_shard, workers, store, (aggregator,))
@@ -0,0 +1,253 @@
+"""
+Opt-in timing of loaders and reports
+
+Code marks its stages with stage() or @profiled(). Nothing is recorded until
+enable() is called (or RAILWAY_PROFILE environment variable is set), so
+stages cost one flag check when profiling is off. When on, every stage
+records wall time, CPU time, optional row count and peak of memory traced by
+tracemalloc during the stage. Records can be written as JSON or as Chrome
+trace (open in chrome://tracing or https://ui.perfetto.dev).
+
+Stages run in worker processes are not recorded.
+"""
+
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Environment variables used when enable() is not called
+ENABLE_ENV = "RAILWAY_PROFILE"
+DIRECTORY_ENV = "RAILWAY_PROFILE_DIR"
+
+_settings = {"enabled": False, "memory": True, "directory": None,
+             "cprofile": False}
+_events = []
+_local = threading.local()
+
+
+class _Disabled:
+    """Shared do-nothing stage"""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_DISABLED = _Disabled()
+
+
+class Stage:
+    """
+    One measured stage, 'rows' can be set inside the 'with' block
+    """
+
+    def __init__(self, name: str, rows: int = None):
+        self.name = name
+        self.rows = rows
+        self.peak = 0
+        self._base = 0
+
+    def __enter__(self):
+        stack = _stack()
+        self.depth = len(stack)
+        if _settings["memory"] and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self._base = self.peak = current
+        stack.append(self)
+        self._cpu = time.process_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._start
+        cpu = time.process_time() - self._cpu
+        stack = _stack()
+        stack.pop()
+        memory = None
+        if _settings["memory"] and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            memory = self.peak - self._base
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+        _events.append({"name": self.name, "start": self._start,
+                        "wall": wall, "cpu": cpu, "rows": self.rows,
+                        "peak_memory": memory, "depth": self.depth,
+                        "pid": os.getpid(), "tid": threading.get_ident()})
+        return False
+
+
+def _stack() -> list:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def enable(directory: str = None, memory: bool = True,
+           cprofile: bool = False) -> None:
+    """
+    :param directory: Folder for profiles of reports (see report_profile())
+    and for write_all()
+    :param memory: Trace memory allocations (slows down allocations)
+    :param cprofile: Save cProfile statistics of every report in directory
+    """
+    _settings.update(enabled=True, memory=memory, directory=directory,
+                     cprofile=cprofile and directory is not None)
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable() -> None:
+    _settings["enabled"] = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled() -> bool:
+    return _settings["enabled"]
+
+
+def stage(name: str, rows: int = None):
+    """
+    Context manager measuring a stage
+    :param name: Name of the stage, e.g. "helper.get_store"
+    :param rows: Number of processed rows, if known before
+    """
+    if not _settings["enabled"]:
+        return _DISABLED
+    return Stage(name, rows)
+
+
+def profiled(name: str = None, rows=None):
+    """
+    Decorator measuring every call of a function
+    :param name: Name of the stage (default: module.function)
+    :param rows: Function returning number of rows from result (e.g. len)
+    """
+
+    def decorate(func):
+        label = name or "%s.%s" % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _settings["enabled"]:
+                return func(*args, **kwargs)
+            with Stage(label) as s:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    s.rows = rows(result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def report_profile(name: str):
+    """
+    Measures a report as a stage and, when enabled, saves its cProfile
+    statistics as <directory>/<name>.prof (open with pstats or snakeviz)
+    :param name: Name of the report
+    """
+    if not _settings["enabled"]:
+        yield
+        return
+    profiler = cProfile.Profile() if _settings["cprofile"] else None
+    with Stage("report." + name):
+        if profiler is None:
+            yield
+        else:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(_settings["directory"],
+                                                 name + ".prof"))
+
+
+def events() -> list:
+    """
+    :return: Recorded stages in order of their end
+    """
+    return list(_events)
+
+
+def reset() -> None:
+    del _events[:]
+
+
+def summary() -> dict:
+    """
+    :return: Stage name : {calls, wall, cpu, rows, peak_memory} totals
+    (peak_memory is the largest peak of all calls)
+    """
+    result = {}
+    for e in _events:
+        s = result.setdefault(e["name"], {"calls": 0, "wall": 0.0,
+                                          "cpu": 0.0, "rows": 0,
+                                          "peak_memory": 0})
+        s["calls"] += 1
+        s["wall"] += e["wall"]
+        s["cpu"] += e["cpu"]
+        s["rows"] += e["rows"] or 0
+        s["peak_memory"] = max(s["peak_memory"], e["peak_memory"] or 0)
+    return result
+
+
+def write_json(path: str) -> None:
+    with open(path, "w") as f:
+        json.dump({"summary": summary(), "events": _events}, f, indent=2)
+
+
+def write_chrome_trace(path: str) -> None:
+    """
+    :param path: Output file in Chrome trace event format
+    """
+    origin = min([e["start"] for e in _events] or [0])
+    trace = []
+    for e in _events:
+        trace.append({"name": e["name"], "ph": "X", "pid": e["pid"],
+                      "tid": e["tid"],
+                      "ts": (e["start"] - origin) * 1e6,
+                      "dur": e["wall"] * 1e6,
+                      "args": {k: e[k] for k in ("cpu", "rows",
+                                                 "peak_memory")}})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def write_all(directory: str = None) -> list:
+    """
+    Writes profile.json and trace.json
+    :param directory: Output folder (default: folder given to enable())
+    :return: Written files
+    """
+    directory = directory or _settings["directory"] or "."
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, "profile.json"),
+             os.path.join(directory, "trace.json")]
+    write_json(paths[0])
+    write_chrome_trace(paths[1])
+    return paths
+
+
+if os.environ.get(ENABLE_ENV):
+    enable(os.environ.get(DIRECTORY_ENV),
+           cprofile=os.environ.get(DIRECTORY_ENV) is not None)
+    if os.environ.get(DIRECTORY_ENV):
+        atexit.register(write_all)
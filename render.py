@@ -0,0 +1,178 @@
+"""
+Rendering of report figures
+
+By default figures are shown on screen with plt.show(). When an output
+directory is configured (configure() or RAILWAY_OUTPUT_DIR environment
+variable), non-interactive Agg backend is used and every figure is saved in
+all configured formats and closed, so that any number of reports can be
+rendered in one process on machines without display.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+
+import matplotlib
+import numpy as np
+
+from profiling import stage
+
+# Environment variables used when configure() is not called
+OUTPUT_DIR_ENV = "RAILWAY_OUTPUT_DIR"
+FORMATS_ENV = "RAILWAY_FORMATS"  # Comma separated, e.g. "png,svg"
+
+_settings = {"output_dir": None, "formats": ("png",), "dpi": 150}
+
+
+def configure(output_dir: str = None, formats=("png",),
+              dpi: int = 150) -> None:
+    """
+    :param output_dir: Directory for figures, None shows them on screen
+    :param formats: Any format supported by matplotlib (png, svg, pdf ...)
+    :param dpi: Resolution of raster formats
+    """
+    _settings["output_dir"] = output_dir
+    _settings["formats"] = tuple(formats)
+    _settings["dpi"] = dpi
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        import matplotlib.pyplot as plt
+        plt.switch_backend("Agg")
+
+
+def settings() -> dict:
+    """
+    :return: Current settings, can be passed to configure()
+    """
+    return dict(_settings)
+
+
+def is_headless() -> bool:
+    return _settings["output_dir"] is not None
+
+
+def show(name: str, fig=None, close: bool = True) -> list:
+    """
+    Replacement of plt.show() for reports
+    :param name: File name of the figure (without extension)
+    :param fig: Figure (default: current figure)
+    :param close: If False, figure is kept open to be drawn again
+    :return: List of written files (empty when shown on screen)
+    """
+    import matplotlib.pyplot as plt
+    if not is_headless():
+        plt.show()
+        return []
+
+    if fig is None:
+        fig = plt.gcf()
+    paths = []
+    with stage("render." + name):
+        for fmt in _settings["formats"]:
+            path = os.path.join(_settings["output_dir"], name + "." + fmt)
+            fig.savefig(path, dpi=_settings["dpi"], bbox_inches="tight")
+            paths.append(path)
+    if close:
+        # Figures are not garbage collected by pyplot until they are closed
+        plt.close(fig)
+    return paths
+
+
+def polygon_path(geometry):
+    """
+    :param geometry: Shapely Polygon or MultiPolygon
+    :return: Matplotlib Path (holes included)
+    """
+    from matplotlib.path import Path
+
+    polygons = getattr(geometry, "geoms", [geometry])
+    paths = []
+    for polygon in polygons:
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            paths.append(Path(np.asarray(ring.coords)[:, :2], closed=True))
+    return Path.make_compound_path(*paths)
+
+
+class ChoroplethRenderer:
+    """
+    Draws same set of polygons many times with different colours
+
+    Figure and one PatchCollection are created once, later maps only
+    change face colours of the collection.
+    """
+
+    def __init__(self, geometries: list, edgecolor="w",
+                 figsize=(6, 6)):
+        """
+        :param geometries: Shapely polygons in drawing order
+        :param edgecolor: Colour of boundaries
+        :param figsize: Size of figure
+        """
+        self.geometries = geometries
+        self.edgecolor = edgecolor
+        self.figsize = figsize
+        self._create()
+
+    def _create(self) -> None:
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import PatchCollection
+        from matplotlib.patches import PathPatch
+
+        self.figure, self.ax = plt.subplots(figsize=self.figsize)
+        patches = [PathPatch(polygon_path(g)) for g in self.geometries]
+        self.collection = PatchCollection(patches, edgecolor=self.edgecolor)
+        self.ax.add_collection(self.collection)
+        self.ax.autoscale_view()
+        self.ax.set_aspect("equal")
+        self.ax.axis("off")
+
+    def render(self, colors: list, name: str) -> list:
+        """
+        :param colors: Face colour of every polygon
+        :param name: File name of the figure, see show()
+        :return: See show()
+        """
+        import matplotlib.pyplot as plt
+
+        if not plt.fignum_exists(self.figure.number):
+            # Window was closed by the user
+            self._create()
+        self.collection.set_facecolor(colors)
+        plt.figure(self.figure.number)
+        return show(name, self.figure, close=False)
+
+    def close(self) -> None:
+        import matplotlib.pyplot as plt
+        plt.close(self.figure)
+
+
+def _render(target: str, kwargs: dict):
+    module, function = target.split(":")
+    return getattr(import_module(module), function)(**kwargs)
+
+
+def render_many(targets: list, workers: int = None) -> list:
+    """
+    Runs report functions, optionally in several processes. Reports should
+    call show() to save their figures.
+    :param targets: List of "module:function" strings or ("module:function",
+    kwargs) tuples
+    :param workers: Number of processes (None or 1 runs in this process)
+    :return: Return values of the functions
+    """
+    jobs = [(x, {}) if isinstance(x, str) else x for x in targets]
+    if workers is None or workers <= 1 or len(jobs) < 2:
+        return [_render(t, k) for t, k in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure,
+                             initargs=(_settings["output_dir"],
+                                       _settings["formats"],
+                                       _settings["dpi"])) as pool:
+        futures = [pool.submit(_render, t, k) for t, k in jobs]
+        return [f.result() for f in futures]
+
+
+if os.environ.get(OUTPUT_DIR_ENV):
+    matplotlib.use("Agg")
+    configure(os.environ[OUTPUT_DIR_ENV],
+              os.environ.get(FORMATS_ENV, "png").split(","))
@@ -0,0 +1,105 @@
+"""
+Registry of reports which can be run from main.py
+
+Time table and station file are loaded once (load_context()) and shared by
+every report run in this process. Worker processes started by
+run_reports() open the memory mapped time table cache instead of parsing
+the CSV file again.
+"""
+
+import inspect
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+
+import helper
+import render
+from profiling import report_profile
+
+# Report name : "module:function"
+REPORTS = OrderedDict([
+    ("get_statistics", "blog1.travel_to_moon:get_statistics"),
+    ("stations_with_most_trains",
+     "blog1.travel_to_moon:stations_with_most_trains"),
+    ("train_distance", "blog1.travel_to_moon:train_distance"),
+    ("stations_with_cut_off", "blog1.travel_to_moon:stations_with_cut_off"),
+    ("stations_with_train_origin",
+     "blog1.travel_to_moon:stations_with_train_origin"),
+    ("stations_pairs", "blog1.travel_to_moon:stations_pairs"),
+    ("get_state_info", "blog1.travel_to_moon:get_state_info"),
+    ("train_distribution", "blog2.new_vs_old:train_distribution"),
+    ("zone_wise_distribution", "blog2.new_vs_old:zone_wise_distribution"),
+    ("zonal_connectivity", "blog2.new_vs_old:zonal_connectivity"),
+    ("state_wise_connectivity", "blog2.new_vs_old:state_wise_connectivity"),
+    ("different_states_connected",
+     "blog2.new_vs_old:different_states_connected"),
+    ("plot_most_stops", "blog3.visualize_maps:plot_most_stops"),
+    ("plot_most_stations", "blog3.visualize_maps:plot_most_stations"),
+    ("train_origin_data", "blog3.visualize_maps:train_origin_data"),
+    ("inter_state_trains", "blog3.visualize_maps:inter_state_trains"),
+    ("train_departure_time", "blog3.visualize_maps:train_departure_time"),
+    ("common_timings", "blog3.visualize_maps:common_timings"),
+])
+
+
+def get_report(name: str):
+    """
+    :param name: Name of the report (key of REPORTS)
+    :return: Report function
+    """
+    if name not in REPORTS:
+        raise KeyError("Unknown report '%s'. Available reports: %s" % (
+            name, ", ".join(REPORTS)))
+    module, function = REPORTS[name].split(":")
+    return getattr(import_module(module), function)
+
+
+def load_context() -> None:
+    """
+    Loads time table and station data which are shared by all reports
+    """
+    helper.get_store()
+    helper.get_station_index()
+
+
+def run_report(name: str, workers: int = None):
+    """
+    :param name: Name of the report
+    :param workers: Passed to reports which can use several processes
+    :return: Return value of the report
+    """
+    func = get_report(name)
+    with report_profile(name):
+        if workers is not None and "workers" in inspect.signature(
+                func).parameters:
+            return func(workers=workers)
+        return func()
+
+
+def _init_worker(data_file: str, station_file: str, settings: dict):
+    helper.TRAIN_DATA_FILE = data_file
+    helper.STATION_DATA_FILE = station_file
+    render.configure(**settings)
+
+
+def run_reports(names: list, workers: int = None) -> list:
+    """
+    Runs reports one after another, or each in its own process when
+    workers > 1
+    :param names: Names of reports
+    :param workers: Number of processes
+    :return: Return values of the reports
+    """
+    for name in names:
+        get_report(name)
+    load_context()
+
+    if workers is None or workers <= 1 or len(names) < 2:
+        return [run_report(x, workers) for x in names]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(helper.TRAIN_DATA_FILE,
+                                       helper.STATION_DATA_FILE,
+                                       render.settings())) as pool:
+        futures = [pool.submit(run_report, x) for x in names]
+        return [f.result() for f in futures]
@@ -0,0 +1,156 @@
+"""
+Disk cache for results of expensive analyses
+
+Functions decorated with cached_result() are called only when their
+arguments, their source code or data files (time table and station file,
+see helper.data_fingerprint()) changed since the last call. Results are pickled
+in CACHE_DIR. Least recently used results are removed when the cache grows
+beyond its size limit.
+"""
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+
+from helper import data_fingerprint
+
+# Environment variables to change defaults
+CACHE_DIR_ENV = "RAILWAY_CACHE_DIR"
+DISABLE_ENV = "RAILWAY_NO_RESULT_CACHE"
+
+CACHE_DIR = os.environ.get(CACHE_DIR_ENV, ".railway_cache")
+MAX_BYTES = 512 * 1024 * 1024
+
+
+def _enabled() -> bool:
+    return not os.environ.get(DISABLE_ENV)
+
+
+def code_version(func, version=None) -> str:
+    """
+    :param func: Cached function
+    :param version: Extra version, change it when code called by func
+    changes the result
+    :return: Hash of source code of func and version
+    """
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = func.__code__.co_code
+    return hashlib.sha1(code + repr(version).encode()).hexdigest()
+
+
+def cache_key(func, args: tuple, kwargs: dict, ignore=(),
+              version: str = None) -> str:
+    """
+    :param func: Cached function
+    :param args: Positional arguments
+    :param kwargs: Keyword arguments
+    :param ignore: Names of arguments which do not change the result
+    :param version: Result of code_version() (default: calculated now)
+    :return: Key which depends on function, its code, arguments and data
+    files
+    """
+    if version is None:
+        version = code_version(func)
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    params = sorted((k, v) for k, v in bound.arguments.items()
+                    if k not in ignore)
+    payload = (func.__module__, func.__qualname__, version, params,
+               sorted(data_fingerprint().items()))
+    return hashlib.sha1(pickle.dumps(payload, protocol=4)).hexdigest()
+
+
+def evict(max_bytes: int = MAX_BYTES, directory: str = None) -> None:
+    """
+    Removes least recently used results until cache fits in max_bytes
+    :param max_bytes: Size limit
+    :param directory: Cache directory (default: CACHE_DIR)
+    """
+    directory = directory or CACHE_DIR
+    entries = []
+    with os.scandir(directory) as it:
+        for e in it:
+            if e.name.endswith(".pkl"):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+    total = sum(x[1] for x in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def clear(directory: str = None) -> None:
+    """
+    Removes all cached results
+    :param directory: Cache directory (default: CACHE_DIR)
+    """
+    evict(0, directory)
+
+
+def cached_result(func=None, ignore=(), max_bytes: int = MAX_BYTES,
+                  version=None):
+    """
+    Decorator to cache results on disk
+    :param func: Function with picklable arguments and return value
+    :param ignore: Names of arguments which do not change the result (e.g.
+    number of worker processes)
+    :param max_bytes: Size limit of the cache directory
+    :param version: See code_version()
+    """
+    if func is None:
+        return functools.partial(cached_result, ignore=ignore,
+                                 max_bytes=max_bytes, version=version)
+    code = code_version(func, version)
+
+    def _path(args, kwargs):
+        return os.path.join(CACHE_DIR, cache_key(func, args, kwargs,
+                                                 ignore, code) + ".pkl")
+
+    def _save(path, result):
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            temp = "%s.tmp-%d" % (path, os.getpid())
+            with open(temp, "wb") as f:
+                pickle.dump(result, f, protocol=4)
+            os.replace(temp, path)
+            evict(max_bytes)
+        except OSError:
+            pass
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled():
+            return func(*args, **kwargs)
+
+        path = _path(args, kwargs)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+            os.utime(path)  # Mark as recently used
+            return result
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        result = func(*args, **kwargs)
+        _save(path, result)
+        return result
+
+    def put(result, *args, **kwargs):
+        """
+        Saves result computed elsewhere (e.g. delta.update_aggregate()) as
+        result of func(*args, **kwargs) for current data files
+        """
+        if _enabled():
+            _save(_path(args, kwargs), result)
+
+    wrapper.put = put
+    return wrapper
@@ -0,0 +1,170 @@
+"""
+Indexed access to station metadata (STATION_DATA_FILE)
+
+Every line of the file is 'code;name;state;zone'. StationIndex parses it
+once and keeps names, states and zones in parallel arrays with integer ids
+so that millions of lookups can be done with array indexing.
+"""
+
+import numpy as np
+
+# Values which are written when state or zone could not be found
+MISSING_LABELS = ("", "None")
+
+
+def normalise_code(code) -> str:
+    """
+    :param code: Station code as found in any of the data files
+    :return: Code without surrounding spaces, in upper case
+    """
+    return str(code).strip().upper()
+
+
+def merge_codes(codes) -> tuple:
+    """
+    Codes which are same after normalise_code() get one id (e.g. padded
+    codes of the time table)
+    :param codes: Station codes, e.g. TimetableStore.station_codes
+    :return: (normalised codes, array of id of every code in codes)
+    """
+    index = {}
+    ids = np.fromiter((index.setdefault(normalise_code(x), len(index))
+                       for x in codes), dtype=np.int64, count=len(codes))
+    return list(index), ids
+
+
+def _intern_label(label: str, labels: list, index: dict) -> int:
+    label = label.strip()
+    if label in MISSING_LABELS:
+        return -1
+    if label not in index:
+        index[label] = len(labels)
+        labels.append(label)
+    return index[label]
+
+
+class StationIndex:
+    """
+    Station codes, names, states and zones with integer ids
+
+    codes[i], names[i] belong to station id 'i'. state_ids[i] and
+    zone_ids[i] are positions in 'states' and 'zones' lists (-1 if not
+    known).
+    """
+
+    def __init__(self, fields: list):
+        self.fields = fields  # Raw fields of every line
+        self.codes = []
+        self.names = []
+        self.states = []
+        self.zones = []
+        self._id = {}
+        state_index = {}
+        zone_index = {}
+        state_ids = []
+        zone_ids = []
+
+        for values in fields:
+            code = normalise_code(values[0])
+            if code in self._id:
+                # Later line wins, same as earlier dictionary based lookup
+                i = self._id[code]
+            else:
+                i = len(self.codes)
+                self._id[code] = i
+                self.codes.append(code)
+                self.names.append(None)
+                state_ids.append(-1)
+                zone_ids.append(-1)
+            self.names[i] = values[1].strip() if len(values) > 1 else ""
+            if len(values) > 2:
+                state_ids[i] = _intern_label(values[2], self.states,
+                                             state_index)
+            if len(values) > 3:
+                zone_ids[i] = _intern_label(values[3], self.zones,
+                                            zone_index)
+
+        self.state_ids = np.asarray(state_ids, dtype=np.int32)
+        self.zone_ids = np.asarray(zone_ids, dtype=np.int32)
+
+    @classmethod
+    def from_file(cls, path: str) -> "StationIndex":
+        """
+        :param path: Semicolon separated station file
+        :return: StationIndex
+        """
+        fields = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if len(line) > 0:
+                    fields.append(line.split(";"))
+        return cls(fields)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return normalise_code(code) in self._id
+
+    def id(self, code) -> int:
+        """
+        :param code: Station code
+        :return: Station id or -1 if station is not known
+        """
+        return self._id.get(normalise_code(code), -1)
+
+    def ids(self, codes) -> np.ndarray:
+        """
+        Bulk version of id(), every distinct code is looked up only once
+        :param codes: Iterable or array of station codes
+        :return: Array of station ids (-1 if not known)
+        """
+        codes = np.asarray(codes, dtype=object)
+        if codes.size == 0:
+            return np.zeros(codes.shape, dtype=np.int32)
+        unique, inverse = np.unique(codes.astype(str), return_inverse=True)
+        found = np.asarray([self.id(x) for x in unique], dtype=np.int32)
+        return found[inverse].reshape(codes.shape)
+
+    def state_id(self, station_id: int) -> int:
+        return int(self.state_ids[station_id]) if station_id >= 0 else -1
+
+    def zone_id(self, station_id: int) -> int:
+        return int(self.zone_ids[station_id]) if station_id >= 0 else -1
+
+    def state_ids_of(self, station_ids: np.ndarray) -> np.ndarray:
+        """
+        :param station_ids: Array of station ids (-1 allowed)
+        :return: Array of state ids (-1 if not known)
+        """
+        return self._labels_of(self.state_ids, station_ids)
+
+    def zone_ids_of(self, station_ids: np.ndarray) -> np.ndarray:
+        """
+        :param station_ids: Array of station ids (-1 allowed)
+        :return: Array of zone ids (-1 if not known)
+        """
+        return self._labels_of(self.zone_ids, station_ids)
+
+    @staticmethod
+    def _labels_of(label_ids: np.ndarray, station_ids) -> np.ndarray:
+        station_ids = np.asarray(station_ids)
+        # Extra -1 at the end is picked by unknown (-1) stations
+        return np.append(label_ids, -1)[station_ids]
+
+    def state(self, code) -> str:
+        """
+        :param code: Station code
+        :return: State acronym or None
+        """
+        i = self.state_id(self.id(code))
+        return self.states[i] if i >= 0 else None
+
+    def zone(self, code) -> str:
+        """
+        :param code: Station code
+        :return: Zone or None
+        """
+        i = self.zone_id(self.id(code))
+        return self.zones[i] if i >= 0 else None
@@ -0,0 +1,453 @@
+"""
+Column oriented access to the train time table
+
+TimetableStore parses TRAIN_DATA_FILE once and keeps every column as
+dictionary encoded NumPy arrays (one integer code per row and a list of
+unique values per column). Numeric views such as sequence number, arrival /
+departure time in seconds and distance are derived from the unique values,
+so every distinct string is parsed only once.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Same order as columns in the CSV file
+COLUMNS = ("number", "name", "seq", "station_code", "station_name",
+           "arrival_time", "departure_time", "distance", "source_station",
+           "source_station_name", "destination_station",
+           "destination_station_name")
+
+# Used for integer values which can not be parsed
+MISSING = -1
+
+# Increase when layout of the cache directory changes
+CACHE_VERSION = 2
+
+# Arrays derived from the columns, stored in cache along with the codes
+DERIVED = ("seq", "arrival", "departure", "distance", "stop_rows",
+           "train_offsets")
+
+
+def parse_int(text: str) -> int:
+    """
+    :param text: String from CSV file
+    :return: Integer value or MISSING if value is not an integer
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return MISSING
+
+
+def parse_distance(text: str) -> float:
+    """
+    :param text: String from CSV file
+    :return: Float value or NaN (few trains have 'NA' in this field)
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def parse_seconds(text: str) -> int:
+    """
+    Converts time of the day into seconds since midnight
+    :param text: Time in 'HH:MM:SS' (or 'HH:MM') format
+    :return: Seconds since midnight or MISSING if time is malformed
+    """
+    parts = text.strip().split(":")
+    if len(parts) == 2:
+        parts.append("0")
+    if len(parts) != 3:
+        return MISSING
+    try:
+        hour, minute, second = [int(x) for x in parts]
+    except ValueError:
+        return MISSING
+    if 0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60:
+        return hour * 3600 + minute * 60 + second
+    return MISSING
+
+
+def format_seconds(seconds: int) -> str:
+    """
+    :param seconds: Seconds since midnight
+    :return: Time in 'HH:MM:SS' format
+    """
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                               seconds % 60)
+
+
+def time_histogram(seconds: np.ndarray, bin_minutes: int = 60,
+                   filter=None) -> np.ndarray:
+    """
+    Histogram of times of the day, malformed times (MISSING) are ignored
+    :param seconds: Array of seconds since midnight
+    :param bin_minutes: Width of every bin (e.g. 5, 15 or 60 minutes)
+    :param filter: Indices or boolean mask of values to include
+    :return: Counts of every bin, bin 'i' starts at i * bin_minutes
+    """
+    if filter is not None:
+        seconds = seconds[filter]
+    seconds = seconds[seconds >= 0]
+    width = bin_minutes * 60
+    return np.bincount(seconds // width, minlength=-(-86400 // width))
+
+
+def is_header(row: list) -> bool:
+    return not row[2].strip().isdigit()
+
+
+def file_hash(path: str) -> str:
+    """
+    :param path: Any file
+    :return: SHA1 of file content
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_fingerprint(path: str, with_hash: bool = True) -> dict:
+    """
+    :param path: Any file
+    :param with_hash: If True, content hash is also calculated
+    :return: Dictionary with size, modification time and content hash
+    """
+    st = os.stat(path)
+    fingerprint = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        fingerprint["sha1"] = file_hash(path)
+    return fingerprint
+
+
+def default_cache_dir(path: str) -> str:
+    """
+    :param path: Time table CSV file
+    :return: Cache directory kept next to the CSV file
+    """
+    return os.path.abspath(path) + ".cache"
+
+
+def find_trains(distance: np.ndarray, numbers: np.ndarray) -> tuple:
+    """
+    :param distance: Distance of every row (NaN if not numeric)
+    :param numbers: Train number code of every row
+    :return: (stop_rows, train_offsets), see TimetableStore
+    """
+    stop_rows = np.flatnonzero(~np.isnan(distance))
+    numbers = numbers[stop_rows]
+    change = np.flatnonzero(numbers[1:] != numbers[:-1]) + 1
+    if len(numbers) > 0:
+        offsets = np.concatenate(([0], change, [len(numbers)]))
+    else:
+        offsets = np.zeros(1)
+    return stop_rows, offsets.astype(np.int64)
+
+
+class TimetableStore:
+    """
+    Parse-once, columnar store of the train time table
+
+    Rows with numeric distance are 'stops'. Consecutive stops with same
+    train number form one train; stop_rows[train_offsets[k]:train_offsets[
+    k + 1]] are row indices of k-th train.
+    """
+
+    def __init__(self, codes: dict, categories: dict, header=None,
+                 derived: dict = None):
+        self.header = header
+        self._codes = codes
+        self._categories = categories
+        self._lookup = {}
+        self.path = None  # CSV file, if store was created from one
+        self.source = None  # Fingerprint of the CSV file, if known
+        self.report = None  # IngestReport, if store was parsed from CSV
+        self.cache_dir = None  # Cache directory, if store is kept in one
+
+        if derived is not None:
+            for name in DERIVED:
+                setattr(self, name, derived[name])
+            return
+
+        self.seq = self._derive("seq", parse_int, np.int32)
+        self.arrival = self._derive("arrival_time", parse_seconds, np.int32)
+        self.departure = self._derive("departure_time", parse_seconds,
+                                      np.int32)
+        self.distance = self._derive("distance", parse_distance, np.float64)
+
+        self.stop_rows, self.train_offsets = find_trains(
+            self.distance, self._codes["number"])
+
+    @classmethod
+    def from_csv(cls, path: str, engine: str = None) -> "TimetableStore":
+        """
+        Reads and validates CSV file, see ingest.read_timetable()
+        :param path: Path of time table CSV file
+        :param engine: See ingest.read_timetable()
+        :return: TimetableStore, problems found are in its 'report'
+        """
+        from ingest import read_timetable
+
+        header, codes, categories, report = read_timetable(path, engine)
+        store = cls(codes, categories, header)
+        store.path = path
+        store.report = report
+        return store
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "TimetableStore":
+        """
+        Loads store saved with save()
+        :param directory: Cache directory
+        :param mmap: If True, arrays are memory mapped (read only)
+        :return: TimetableStore
+        """
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            raise ValueError("Unsupported cache version in " + directory)
+        mode = "r" if mmap else None
+
+        def _array(name):
+            return np.load(os.path.join(directory, name + ".npy"),
+                           mmap_mode=mode)
+
+        store = cls({c: _array("codes_" + c) for c in COLUMNS},
+                    meta["categories"], meta["header"],
+                    {d: _array(d) for d in DERIVED})
+        store.source = meta["source"]
+        return store
+
+    def save(self, directory: str) -> None:
+        """
+        Saves store as .npy files (one per array) and meta.json. Directory
+        is written under temporary name and renamed when complete, so
+        readers never see half written cache.
+        :param directory: Cache directory
+        """
+        temp = "%s.tmp-%d" % (directory, os.getpid())
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        for c in COLUMNS:
+            np.save(os.path.join(temp, "codes_" + c + ".npy"),
+                    self._codes[c])
+        for d in DERIVED:
+            np.save(os.path.join(temp, d + ".npy"), getattr(self, d))
+        self._write_meta(temp)
+
+        if os.path.isdir(directory):
+            old = "%s.old-%d" % (directory, os.getpid())
+            try:
+                os.rename(directory, old)
+            except OSError:
+                pass
+            shutil.rmtree(old, ignore_errors=True)
+        try:
+            os.rename(temp, directory)
+        except OSError:
+            # Other process has written the cache in the meantime
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def _write_meta(self, directory: str) -> None:
+        temp = os.path.join(directory, "meta.json.tmp-%d" % os.getpid())
+        with open(temp, "w") as f:
+            json.dump({"version": CACHE_VERSION, "source": self.source,
+                       "header": self.header,
+                       "categories": self._categories}, f)
+        os.replace(temp, os.path.join(directory, "meta.json"))
+
+    @classmethod
+    def cached(cls, path: str, cache_dir: str = None) -> "TimetableStore":
+        """
+        Loads store from the cache directory if it was created from the
+        current version of the CSV file, otherwise parses the CSV file and
+        rebuilds the cache. Size and modification time are checked first,
+        content hash only when they differ.
+        :param path: Time table CSV file
+        :param cache_dir: Cache directory (default: next to the CSV file)
+        :return: TimetableStore
+        """
+        cache_dir = cache_dir or default_cache_dir(path)
+        current = file_fingerprint(path, with_hash=False)
+        try:
+            store = cls.load(cache_dir)
+            store.path = path
+            store.cache_dir = cache_dir
+            source = store.source
+            if source["size"] == current["size"]:
+                if source["mtime_ns"] == current["mtime_ns"]:
+                    return store
+                if source["sha1"] == file_hash(path):
+                    # File was touched but not changed
+                    source.update(current)
+                    try:
+                        store._write_meta(cache_dir)
+                    except OSError:
+                        pass
+                    return store
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        store = cls.from_csv(path)
+        store.source = file_fingerprint(path)
+        try:
+            store.save(cache_dir)
+            store.cache_dir = cache_dir
+        except OSError:
+            # Read only location, work without cache
+            pass
+        return store
+
+    def apply_delta(self, rows: list, removed=()) -> tuple:
+        """
+        Creates new store in which trains are replaced, added or removed.
+        All rows of a train number are replaced by its rows in the delta.
+        Kept rows are copied, only rows of the delta are parsed, and codes
+        of existing values (e.g. station ids) do not change.
+        :param rows: All rows (list of strings) of added or modified trains
+        :param removed: Train numbers to remove
+        :return: (new store, ids of removed or replaced trains in this
+        store, ids of added trains in new store)
+        """
+        # Rows of one train number should be contiguous
+        first = {}
+        for r in rows:
+            first.setdefault(r[0], len(first))
+        rows = sorted(rows, key=lambda r: first[r[0]])
+
+        numbers = set(first) | set(removed)
+        affected = np.asarray([i for i, x in enumerate(
+            self._categories["number"]) if x in numbers], dtype=np.int32)
+        old_trains = np.flatnonzero(np.isin(
+            self.train_ids[self.first_stops()], affected))
+        keep = np.flatnonzero(~np.isin(self.train_ids, affected))
+
+        codes, categories = {}, {}
+        for i, c in enumerate(COLUMNS):
+            table = {x: k for k, x in enumerate(self._categories[c])}
+            new = [table.setdefault(r[i], len(table)) for r in rows]
+            categories[c] = list(table)
+            codes[c] = np.concatenate((self._codes[c][keep],
+                                       np.asarray(new, dtype=np.int32)))
+
+        derived = {}
+        for name, column, parser, dtype in (
+                ("seq", 2, parse_int, np.int32),
+                ("arrival", 5, parse_seconds, np.int32),
+                ("departure", 6, parse_seconds, np.int32),
+                ("distance", 7, parse_distance, np.float64)):
+            new = np.asarray([parser(r[column]) for r in rows], dtype=dtype)
+            derived[name] = np.concatenate((getattr(self, name)[keep], new))
+        derived["stop_rows"], derived["train_offsets"] = find_trains(
+            derived["distance"], codes["number"])
+
+        store = TimetableStore(codes, categories, self.header, derived)
+        new_trains = np.flatnonzero(store.first_stops() >= len(keep))
+        return store, old_trains, new_trains
+
+    def _derive(self, column: str, parser, dtype) -> np.ndarray:
+        values = np.asarray([parser(x) for x in self._categories[column]],
+                            dtype=dtype)
+        return values[self._codes[column]]
+
+    def __len__(self):
+        return len(self._codes["number"])
+
+    @property
+    def n_trains(self) -> int:
+        return len(self.train_offsets) - 1
+
+    @property
+    def station_ids(self) -> np.ndarray:
+        """Interned station code of every row"""
+        return self._codes["station_code"]
+
+    @property
+    def station_codes(self) -> list:
+        """Station code of every station id"""
+        return self._categories["station_code"]
+
+    @property
+    def train_ids(self) -> np.ndarray:
+        """Interned train number of every row"""
+        return self._codes["number"]
+
+    @property
+    def train_numbers(self) -> list:
+        """Train number of every train id"""
+        return self._categories["number"]
+
+    def codes(self, column: str) -> np.ndarray:
+        """
+        :param column: One of the COLUMNS
+        :return: Integer code of every row
+        """
+        return self._codes[column]
+
+    def categories(self, column: str) -> list:
+        """
+        :param column: One of the COLUMNS
+        :return: Unique values of the column indexed by code
+        """
+        return self._categories[column]
+
+    def values(self, column: str, rows=None) -> np.ndarray:
+        """
+        :param column: One of the COLUMNS
+        :param rows: Row indices or mask (all rows if None)
+        :return: Object array with original strings
+        """
+        if column not in self._lookup:
+            self._lookup[column] = np.asarray(self._categories[column],
+                                              dtype=object)
+        codes = self._codes[column]
+        if rows is not None:
+            codes = codes[rows]
+        return self._lookup[column][codes]
+
+    def rows(self, rows=None) -> list:
+        """
+        Rebuilds rows as they were in the CSV file
+        :param rows: Row indices or mask (all rows if None)
+        :return: List of rows (list of strings)
+        """
+        columns = [self.values(c, rows).tolist() for c in COLUMNS]
+        return [list(x) for x in zip(*columns)]
+
+    def first_stops(self) -> np.ndarray:
+        """
+        :return: Row index of first stop of every train
+        """
+        return self.stop_rows[self.train_offsets[:-1]]
+
+    def last_stops(self) -> np.ndarray:
+        """
+        :return: Row index of last stop of every train
+        """
+        return self.stop_rows[self.train_offsets[1:] - 1]
+
+    def time_histogram(self, column: str, bin_minutes: int = 60,
+                       filter=None) -> np.ndarray:
+        """
+        :param column: 'arrival' or 'departure'
+        :param bin_minutes: Width of every bin in minutes
+        :param filter: Row indices or boolean mask of rows to include
+        :return: See time_histogram()
+        """
+        return time_histogram(getattr(self, column), bin_minutes, filter)
+
+    def train_rows(self, train: int) -> np.ndarray:
+        """
+        :param train: Index of train (0 to n_trains - 1)
+        :return: Row indices of all stops of given train
+        """
+        return self.stop_rows[
+               self.train_offsets[train]:self.train_offsets[train + 1]]
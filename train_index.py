@@ -0,0 +1,150 @@
+"""
+Inverted index from station to trains stopping at it
+
+Postings of station 'i' are entries indptr[i]:indptr[i + 1] of 'trains',
+'seqs' and 'positions', sorted by (train, seq). Train ids are store train
+ids (see TimetableStore.train_offsets) and positions index stops in
+store.stop_rows order. Station ids are given by stations.merge_codes(), same
+as in graph and journey modules.
+"""
+
+import numpy as np
+
+from helper import get_store
+from stations import merge_codes, normalise_code
+
+
+def concat_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    :return: Concatenation of arange(s, e) for all pairs of starts and ends
+    """
+    lengths = np.maximum(ends - starts, 0)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    shift = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return shift + np.arange(total)
+
+
+class StationTrainIndex:
+    """
+    Postings (train id, seq) of every station, built once from the store
+    """
+
+    def __init__(self, store):
+        """
+        :param store: TimetableStore
+        """
+        self.codes, ids = merge_codes(store.station_codes)
+        self._id = {x: i for i, x in enumerate(self.codes)}
+        offsets = store.train_offsets
+        rows = store.stop_rows
+        self.train_numbers = [store.train_numbers[x] for x in
+                              store.train_ids[rows[offsets[:-1]]]]
+
+        stations = ids[store.station_ids[rows]]
+        train = np.repeat(np.arange(store.n_trains, dtype=np.int32),
+                          np.diff(offsets))
+        seq = store.seq[rows]
+        order = np.lexsort((seq, train, stations))
+
+        self.trains = train[order]
+        self.seqs = seq[order].astype(np.int32)
+        self.positions = order
+        self.indptr = np.r_[0, np.cumsum(
+            np.bincount(stations, minlength=len(self.codes)))].astype(
+            np.int64)
+        # Station of every stop and end (exclusive) of its train
+        self.stop_stations = stations
+        self.train_end = offsets[1:][train]
+
+    def id(self, station) -> int:
+        """
+        :param station: Station code or id
+        :return: Station id
+        """
+        if isinstance(station, (int, np.integer)):
+            return int(station)
+        return self._id[normalise_code(station)]
+
+    def postings(self, station) -> tuple:
+        """
+        :param station: Station code or id
+        :return: (train ids, seqs) of all stops at station
+        """
+        i = self.id(station)
+        s = slice(self.indptr[i], self.indptr[i + 1])
+        return self.trains[s], self.seqs[s]
+
+    def counts(self) -> np.ndarray:
+        """
+        :return: Number of stops at every station id
+        """
+        return np.diff(self.indptr)
+
+    def train_counts(self) -> np.ndarray:
+        """
+        :return: Number of different trains stopping at every station id
+        """
+        counts = self.counts()
+        station = np.repeat(np.arange(len(counts)), counts)
+        new = np.ones(len(self.trains), dtype=bool)
+        new[1:] = (self.trains[1:] != self.trains[:-1]) | (
+                station[1:] != station[:-1])
+        return np.bincount(station[new], minlength=len(counts))
+
+    def trains_at(self, station) -> np.ndarray:
+        """
+        :param station: Station code or id
+        :return: Sorted train ids stopping at station
+        """
+        return np.unique(self.postings(station)[0])
+
+    def direct_trains(self, source, target) -> np.ndarray:
+        """
+        :param source: Station code or id
+        :param target: Station code or id
+        :return: Sorted train ids which stop at source and later at target
+        """
+        a_trains, a_seqs = self.postings(source)
+        b_trains, b_seqs = self.postings(target)
+        # First visit of source and last visit of target in every train
+        a_trains, first = np.unique(a_trains, return_index=True)
+        b_last = len(b_trains) - 1 - np.unique(b_trains[::-1],
+                                               return_index=True)[1]
+        b_trains = b_trains[b_last]
+        common, ia, ib = np.intersect1d(a_trains, b_trains,
+                                        assume_unique=True,
+                                        return_indices=True)
+        return common[a_seqs[first[ia]] < b_seqs[b_last[ib]]]
+
+    def direct_train_numbers(self, source, target) -> list:
+        """
+        :param source: Station code or id
+        :param target: Station code or id
+        :return: Train numbers going from source to target without change
+        """
+        return [self.train_numbers[x] for x in
+                self.direct_trains(source, target)]
+
+    def reachable(self, source) -> np.ndarray:
+        """
+        :param source: Station code or id
+        :return: Sorted station ids reachable from source without changing
+        trains
+        """
+        i = self.id(source)
+        stops = self.positions[self.indptr[i]:self.indptr[i + 1]]
+        later = concat_ranges(stops + 1, self.train_end[stops])
+        found = np.unique(self.stop_stations[later])
+        return found[found != i]
+
+
+def build_index(store=None) -> StationTrainIndex:
+    """
+    :param store: TimetableStore (default: get_store())
+    :return: StationTrainIndex
+    """
+    if store is None:
+        store = get_store()
+    return StationTrainIndex(store)